@@ -1,13 +1,51 @@
 ####Full Name: Haoyang Zeng
 ####Unique Name: haoyangz
 
-from bs4 import BeautifulSoup
+from bs4 import BeautifulSoup, SoupStrainer
 from pathlib import Path
 import requests
 import json
 import sqlite3
 import plotly.graph_objs as go
 import base64
+import io
+import html
+import threading
+import atexit
+import time
+import random
+import hashlib
+import zlib
+import os
+import argparse
+import csv
+import sys
+import re
+import queue
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from collections import deque, OrderedDict
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+try:
+    import lxml
+    HTML_PARSER = "lxml"
+except ImportError:
+    HTML_PARSER = "html.parser"
+
+try:
+    import kaleido
+    STATIC_EXPORT = True
+except ImportError:
+    STATIC_EXPORT = False
+
+try:
+    from PIL import Image as PILImage
+    THUMBNAILS = True
+except ImportError:
+    THUMBNAILS = False
 
 base_url = "https://nierautomata.wiki.fextralife.com/"
 NPC_url = base_url + "NPCs"
@@ -16,11 +54,106 @@ main_quest_url = base_url + "Main+Story+Quests"
 side_quest_url = base_url + "Side+Quests"
 fish_url = base_url + "Fishing"
 CACHE_FILENAME = "NieR_Project_Cache.json"
+CACHE_DBNAME = "NieR_Project_Cache.sqlite"
+CACHE_BATCH_SIZE = 50
+CACHE_MAX_BYTES = 64 * 1024 * 1024
+CACHE_MAX_AGE = None
+CACHE_COMPRESSION_LEVEL = 6
+IMG_CACHE_DIR = "img_cache"
+IMG_CACHE_MAX_BYTES = 256 * 1024 * 1024
+IMG_CACHE_MAX_AGE = None
+FETCH_WORKERS = 8
+FETCH_PER_HOST = 4
+STREAM_WINDOW = 16
+STREAM_QUEUE_SIZE = 256
+STREAM_BATCH_SIZE = 500
+PARSE_WORKERS = 1
+HTTP_TIMEOUT = 20
+HTTP_RETRIES = 3
+HTTP_BACKOFF = 0.5
+HTTP_RATE_LIMIT = None
+OFFLINE = False
+SNAPSHOT_MMAP_SIZE = 268435456
+RETRY_STATUS = [429, 500, 502, 503, 504]
 DBNAME = "NieR.sqlite"
+LOAD_PRAGMAS = ["PRAGMA journal_mode = WAL", "PRAGMA synchronous = OFF", "PRAGMA cache_size = -65536", "PRAGMA temp_store = MEMORY"]
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS QuestGiverIndex ON Quests (Giver)",
+    "CREATE INDEX IF NOT EXISTS QuestLocationIndex ON Quests (Location)",
+    "CREATE INDEX IF NOT EXISTS FishingLocationFishIndex ON FishingLocation (Fish)",
+    "CREATE INDEX IF NOT EXISTS FishingLocationLocationIndex ON FishingLocation (Location)",
+    "CREATE INDEX IF NOT EXISTS QuestCategoryIndex ON Quests (Category)",
+]
+SEARCH_TABLES = {
+    "NPCs": ("NPCSearch", ["Name", "Info"]),
+    "Locations": ("LocationSearch", ["Name", "Info"]),
+    "Quests": ("QuestSearch", ["Name", "Giver", "Reward"]),
+    "Fishes": ("FishSearch", ["Name", "Location"]),
+}
+# Summary table: (key column, aggregate query, key filter column, source tables).
+# The aggregate is restricted by {filter}; every source table maps to the query
+# that selects the keys affected by a changed {row}, so triggers only refresh
+# those keys.
+STATS_TABLES = {
+    "StatsLocationQuests": ("Location",
+        "SELECT Locations.Id, Locations.Name, COUNT(*) FROM Locations JOIN Quests ON Quests.Location = Locations.Id "
+        "WHERE {filter} GROUP BY Locations.Id", "Locations.Id",
+        {"Locations": "SELECT {row}.Id", "Quests": "SELECT {row}.Location"}),
+    "StatsLocationFishes": ("Location",
+        "SELECT Locations.Id, Locations.Name, COUNT(*) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "
+        "WHERE {filter} GROUP BY Locations.Id", "Locations.Id",
+        {"Locations": "SELECT {row}.Id", "FishingLocation": "SELECT {row}.Location"}),
+    "StatsLocationPrice": ("Location",
+        "SELECT Locations.Id, Locations.Name, AVG(Fishes.Price) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "
+        "JOIN Fishes ON Fishes.Id = FishingLocation.Fish WHERE {filter} GROUP BY Locations.Id", "Locations.Id",
+        {"Locations": "SELECT {row}.Id", "FishingLocation": "SELECT {row}.Location",
+         "Fishes": "SELECT Location FROM FishingLocation WHERE Fish = {row}.Id"}),
+    "StatsFishLocations": ("Fish",
+        "SELECT Fishes.Id, Fishes.Name, COUNT(*) FROM Fishes JOIN FishingLocation ON FishingLocation.Fish = Fishes.Id "
+        "JOIN Locations ON Locations.Id = FishingLocation.Location WHERE {filter} GROUP BY Fishes.Id", "Fishes.Id",
+        {"Fishes": "SELECT {row}.Id", "FishingLocation": "SELECT {row}.Fish",
+         "Locations": "SELECT Fish FROM FishingLocation WHERE Location = {row}.Id"}),
+    "StatsNPCQuests": ("NPC",
+        "SELECT NPCs.Id, NPCs.Name, COUNT(*) FROM NPCs JOIN Quests ON Quests.Giver = NPCs.Name "
+        "WHERE {filter} GROUP BY NPCs.Id", "NPCs.Id",
+        {"NPCs": "SELECT {row}.Id", "Quests": "SELECT Id FROM NPCs WHERE Name = {row}.Giver"}),
+}
+QUERY_POOL_SIZE = 4
+QUERY_PRAGMAS = ["PRAGMA query_only = ON", "PRAGMA mmap_size = 268435456", "PRAGMA cache_size = -32768"]
+STATEMENT_CACHE_SIZE = 256
+SERVER_BACKLOG = 1024
+IMAGE_CHUNK_SIZE = 65536
+THUMBNAIL_SIZES = [64, 256]
+THUMBNAIL_QUALITY = 85
+IMAGE_DEFAULT_SIZE = 256
+# Leading bytes: MIME type, file extension.
+IMAGE_SIGNATURES = [
+    (b"\xff\xd8\xff", "image/jpeg", ".jpg"),
+    (b"\x89PNG\r\n\x1a\n", "image/png", ".png"),
+    (b"GIF87a", "image/gif", ".gif"),
+    (b"GIF89a", "image/gif", ".gif"),
+    (b"BM", "image/bmp", ".bmp"),
+    (b"<svg", "image/svg+xml", ".svg"),
+    (b"<?xml", "image/svg+xml", ".svg"),
+]
+QUERY_CACHE_SIZE = 1024
+QUERY_CACHE_TTL = 300
+
+# Bump the version of an entity type when its parse functions change, so
+# only the cached records of that type are parsed again.
+PARSER_VERSIONS = {"NPC": 1, "Location": 1, "Quest": 1, "Fish": 1}
+# The scrapers only look inside the wiki content block or its wiki tables,
+# so pages are parsed with a strainer that skips the rest of the document.
+STRAINERS = {
+    "content": SoupStrainer("div", id = "wiki-content-block"),
+    "tables": SoupStrainer("table", class_ = re.compile(r"\bwiki_table\b")),
+}
 
 none_list = ["??", "N/A", "nothing", "none", "", " "]
 
 class NPC:
+    __slots__ = ("url", "name", "info", "gender", "img_name")
+
     def __init__(self, url, name, info, gender, img_name):
         self.name = name
         self.url = url
@@ -32,6 +165,8 @@ class NPC:
         return f"{self.name} ({self.gender}): {self.info}"
 
 class Location:
+    __slots__ = ("url", "name", "info", "previous_location", "next_location")
+
     def __init__(self, url, name, info, previous_location, next_location):
         self.url = url
         self.name = name
@@ -43,6 +178,8 @@ class Location:
         return f"{self.name}(previous: {self.previous_location}, next: {self.next_location}): {self.info}"
 
 class Quest:
+    __slots__ = ("url", "name", "giver", "location", "reward", "category")
+
     def __init__(self, url, name, giver, location, reward, category):
         self.url = url
         self.name = name
@@ -55,6 +192,8 @@ class Quest:
         return f"{self.name} is a {self.category} quest given by {self.giver} in {self.location}. Reward: {self.reward}"
 
 class Fish:
+    __slots__ = ("url", "name", "location", "img_name", "price")
+
     def __init__(self, url, name, location, img_name, price):
         self.url = url
         self.name = name
@@ -65,10 +204,90 @@ class Fish:
     def __str__(self):
         return f"{self.name}({self.price}) can be found at: {self.location}"
 
+class RecordBatch:
+    '''Columnar container for records of one type.
+    Every field in the __slots__ of the record type is kept as one list, so
+    scrapers can add rows without creating an object per record and the loader
+    can hand the columns straight to executemany. Iterating over a batch still
+    yields record instances.
+    '''
+    def __init__(self, record_type, records = ()):
+        self.record_type = record_type
+        self.columns = {field: [] for field in record_type.__slots__}
+        for record in records:
+            self.append(record)
+
+    def add(self, *values):
+        '''Add one row, with values in the order of the record type's __slots__.'''
+        for column, value in zip(self.columns.values(), values):
+            column.append(value)
+
+    def append(self, record):
+        '''Add one record instance.'''
+        for field, column in self.columns.items():
+            column.append(getattr(record, field))
+
+    def extend(self, records):
+        '''Add all records of another batch or iterable.'''
+        if isinstance(records, RecordBatch):
+            for field, column in self.columns.items():
+                column.extend(records.columns[field])
+        else:
+            for record in records:
+                self.append(record)
+
+    def rows(self, *fields):
+        '''Iterate over tuples of the given fields, for executemany.
+        A field can also be a list of derived values, one per row.'''
+        return zip(*(self.columns[field] if isinstance(field, str) else field for field in fields))
+
+    def __add__(self, other):
+        batch = RecordBatch(self.record_type, ())
+        batch.extend(self)
+        batch.extend(other)
+        return batch
+
+    def __len__(self):
+        return len(next(iter(self.columns.values())))
+
+    def __iter__(self):
+        for values in zip(*self.columns.values()):
+            yield self.record_type(*values)
+
+
+def as_batch(record_type, records):
+    '''Return records as a RecordBatch, converting a list of instances if needed.'''
+    if isinstance(records, RecordBatch):
+        return records
+    return RecordBatch(record_type, records)
+
+
+def set_base_url(url):
+    '''Point all scrapers at another copy of the wiki, e.g. a local mock server.
+        
+    Parameters
+    ----------
+    url: str
+        The base url, ending with a slash.
+    
+    Returns
+    -------
+    None
+    '''
+    global base_url, NPC_url, location_url, main_quest_url, side_quest_url, fish_url
+    base_url = url
+    NPC_url = base_url + "NPCs"
+    location_url = base_url + "Locations"
+    main_quest_url = base_url + "Main+Story+Quests"
+    side_quest_url = base_url + "Side+Quests"
+    fish_url = base_url + "Fishing"
+
+
 def open_cache():
-    ''' Opens the cache file if it exists and loads the JSON into
+    ''' Opens the legacy JSON cache file if it exists and loads the JSON into
     the CACHE_DICT dictionary.
-    if the cache file doesn't exist, creates a new cache dictionary
+    if the cache file doesn't exist, creates a new cache dictionary.
+    Only used to migrate old caches into the PageCache.
     
     Parameters
     ----------
@@ -88,123 +307,786 @@ def open_cache():
     return cache_dict
 
 
-def save_cache(cache_dict):
-    ''' Saves the current state of the cache to disk
+def compress_body(body):
+    '''Compress a page body for storage.'''
+    return zlib.compress(body.encode("utf-8"), CACHE_COMPRESSION_LEVEL)
+
+
+def decompress_body(body):
+    '''Decompress a stored page body. Bodies stored as plain text by older versions are returned as is.'''
+    if isinstance(body, bytes):
+        return zlib.decompress(body).decode("utf-8")
+    return body
+
+
+class PageCache:
+    '''Page cache backed by a SQLite file with one row per url.
+    The file is opened once, lookups only read the requested page and
+    new pages are committed in batches instead of rewriting the whole cache.
+    The ETag and Last-Modified headers of every page are kept for revalidation,
+    and a content hash to tell which pages changed since they were last stored.
+    A second tier, Records, keeps the records parsed from each page.
+    Bodies are stored zlib compressed, and the cache is kept within max_bytes
+    and max_age by evicting the least recently used pages.
+    '''
+    columns = {"ETag": "TEXT", "LastModified": "TEXT", "Hash": "TEXT", "FetchedAt": "REAL", "Size": "INTEGER", "Accessed": "REAL"}
+
+    def __init__(self, filename = CACHE_DBNAME, batch_size = CACHE_BATCH_SIZE, max_bytes = CACHE_MAX_BYTES, max_age = CACHE_MAX_AGE):
+        self.filename = filename
+        self.batch_size = batch_size
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.pending = 0
+        self.fresh = set()
+        self.changed = set()
+        self.accessed = {}
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(filename, check_same_thread = False)
+        self.connection.execute("CREATE TABLE IF NOT EXISTS Pages (Url TEXT PRIMARY KEY, Body TEXT)")
+        existing = [row[1] for row in self.connection.execute("PRAGMA table_info(Pages)")]
+        for column, column_type in self.columns.items():
+            if column not in existing:
+                self.connection.execute(f"ALTER TABLE Pages ADD COLUMN {column} {column_type}")
+        self.connection.execute('''CREATE TABLE IF NOT EXISTS Records (Url TEXT, Kind TEXT, Hash TEXT, Version INTEGER,
+            Data TEXT, PRIMARY KEY (Url, Kind))''')
+        if self.connection.execute("SELECT COUNT(*) FROM Pages").fetchone()[0] == 0:
+            legacy = open_cache()
+            if legacy:
+                self.connection.executemany("INSERT OR REPLACE INTO Pages (Url, Body) VALUES(?, ?)", legacy.items())
+        plain = self.connection.execute("SELECT Url, Body FROM Pages WHERE typeof(Body) = 'text'").fetchall()
+        self.connection.executemany("UPDATE Pages SET Body = ?, Size = ?, Accessed = ? WHERE Url = ?",
+            ((compress_body(body), len(body.encode("utf-8")), time.time(), url) for url, body in plain))
+        self.connection.commit()
+        if plain:
+            self.connection.execute("VACUUM")
+
+    def get(self, url):
+        '''Return the cached body of the url, or None if it is not cached.'''
+        entry = self.get_entry(url)
+        if entry is None:
+            return None
+        return entry[0]
+
+    def get_entry(self, url):
+        '''Return the cached (body, etag, last_modified) of the url, or None if it is not cached.'''
+        with self.lock:
+            row = self.connection.execute("SELECT Body, ETag, LastModified FROM Pages WHERE Url = ?", (url, )).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["hits"] += 1
+            self.accessed[url] = time.time()
+        return (decompress_body(row[0]), row[1], row[2])
+
+    def put(self, url, body, etag = None, last_modified = None):
+        '''Store the body of the url. Changes are committed every batch_size puts.
+        The url is added to changed if it is new or its content hash differs.'''
+        raw = body.encode("utf-8")
+        digest = hashlib.sha256(raw).hexdigest()
+        stored = zlib.compress(raw, CACHE_COMPRESSION_LEVEL)
+        now = time.time()
+        with self.lock:
+            row = self.connection.execute("SELECT Hash FROM Pages WHERE Url = ?", (url, )).fetchone()
+            if row is None or row[0] != digest:
+                self.changed.add(url)
+            self.connection.execute("INSERT OR REPLACE INTO Pages (Url, Body, ETag, LastModified, Hash, FetchedAt, Size, Accessed) "
+                "VALUES(?, ?, ?, ?, ?, ?, ?, ?)", (url, stored, etag, last_modified, digest, now, len(raw), now))
+            self.fresh.add(url)
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.connection.commit()
+                self.pending = 0
+
+    def get_records(self, url, kind, digest, version):
+        '''Return the records parsed from the page, or None if the page was not parsed
+        with this content hash and parser version yet.'''
+        with self.lock:
+            row = self.connection.execute("SELECT Data FROM Records WHERE Url = ? AND Kind = ? AND Hash = ? AND Version = ?",
+                (url, kind, digest, version)).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def put_records(self, url, kind, digest, version, records):
+        '''Store the records parsed from a page with the content hash and parser version they came from.'''
+        with self.lock:
+            self.connection.execute("INSERT OR REPLACE INTO Records (Url, Kind, Hash, Version, Data) VALUES(?, ?, ?, ?, ?)",
+                (url, kind, digest, version, json.dumps(records)))
+            self.pending += 1
+            if self.pending >= self.batch_size:
+                self.connection.commit()
+                self.pending = 0
+
+    def evict(self):
+        '''Drop pages older than max_age, then the least recently used pages until the
+        stored bodies fit in max_bytes. Their records are dropped too. Returns the number of evicted pages.'''
+        self.flush()
+        with self.lock:
+            rows = self.connection.execute("SELECT Url, length(Body), FetchedAt FROM Pages ORDER BY COALESCE(Accessed, 0)").fetchall()
+            total = sum(row[1] for row in rows)
+            victims = []
+            for url, size, fetched_at in rows:
+                too_old = self.max_age is not None and (fetched_at or 0) < time.time() - self.max_age
+                too_big = self.max_bytes is not None and total > self.max_bytes
+                if too_old or too_big:
+                    victims.append((url, ))
+                    total -= size
+            self.connection.executemany("DELETE FROM Pages WHERE Url = ?", victims)
+            self.connection.executemany("DELETE FROM Records WHERE Url = ?", victims)
+            self.connection.commit()
+            self.stats["evictions"] += len(victims)
+        return len(victims)
+
+    def summary(self):
+        '''Return the hit rate, size on disk, bytes saved by compression and evictions of the cache.'''
+        with self.lock:
+            pages, raw, stored = self.connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(Size), 0), COALESCE(SUM(length(Body)), 0) FROM Pages").fetchone()
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return {
+                "pages": pages,
+                "hits": self.stats["hits"],
+                "misses": self.stats["misses"],
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+                "bytes_stored": stored,
+                "bytes_saved": raw - stored,
+                "evictions": self.stats["evictions"],
+            }
+
+    def flush(self):
+        '''Commit all pending changes to disk.'''
+        with self.lock:
+            self.connection.executemany("UPDATE Pages SET Accessed = ? WHERE Url = ?",
+                ((accessed, url) for url, accessed in self.accessed.items()))
+            self.accessed = {}
+            self.connection.commit()
+            self.pending = 0
+
+    def close(self):
+        '''Evict over-budget pages, flush and close the cache file.'''
+        self.evict()
+        self.connection.close()
+
+
+class ImageCache:
+    '''The folder of downloaded images.
+    The modification time of a file is bumped whenever the image is used, so
+    the folder can be kept within max_bytes and max_age by evicting the least
+    recently used files.
+    '''
+    def __init__(self, folder = IMG_CACHE_DIR, max_bytes = IMG_CACHE_MAX_BYTES, max_age = IMG_CACHE_MAX_AGE):
+        self.folder = Path(folder)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def download(self, img_urls):
+        '''Concurrently download the images that are not in the folder yet.
+        The file name is the last part of the url. An error response raises
+        requests.HTTPError and nothing is written for it.'''
+        self.folder.mkdir(parents = True, exist_ok = True)
+        missing = []
+        for url in dict.fromkeys(img_urls):
+            path = self.folder / url.split('/')[-1]
+            if path.exists():
+                os.utime(path)
+                self.stats["hits"] += 1
+            else:
+                missing.append(url)
+                self.stats["misses"] += 1
+        for url, response in zip(missing, fetch_all(missing)):
+            response.raise_for_status()
+            (self.folder / url.split('/')[-1]).write_bytes(response.content)
+
+    def evict(self):
+        '''Delete images older than max_age, then the least recently used images until
+        the folder fits in max_bytes. Returns the number of evicted images.'''
+        if not self.folder.exists():
+            return 0
+        files = sorted((path.stat().st_mtime, path.stat().st_size, path) for path in self.folder.iterdir() if path.is_file())
+        total = sum(size for mtime, size, path in files)
+        evicted = 0
+        for mtime, size, path in files:
+            too_old = self.max_age is not None and mtime < time.time() - self.max_age
+            too_big = self.max_bytes is not None and total > self.max_bytes
+            if not (too_old or too_big):
+                continue
+            path.unlink()
+            total -= size
+            evicted += 1
+        self.stats["evictions"] += evicted
+        return evicted
+
+    def summary(self):
+        '''Return the hit rate, size on disk and evictions of the image cache.'''
+        files = [path for path in self.folder.iterdir() if path.is_file()] if self.folder.exists() else []
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "images": len(files),
+            "hits": self.stats["hits"],
+            "misses": self.stats["misses"],
+            "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else None,
+            "bytes_stored": sum(path.stat().st_size for path in files),
+            "evictions": self.stats["evictions"],
+        }
+
+
+page_cache = None
+
+def get_page_cache():
+    '''Return the shared PageCache, opening it on first use.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    page_cache: PageCache
+        The cache shared by all scrapers.
+    '''
+    global page_cache
+    if page_cache is None:
+        page_cache = PageCache()
+        atexit.register(page_cache.close)
+    return page_cache
+
+
+image_cache = None
+
+def get_image_cache():
+    '''Return the shared ImageCache, creating it on first use.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    image_cache: ImageCache
+        The image cache shared by all scrapers.
+    '''
+    global image_cache
+    if image_cache is None:
+        image_cache = ImageCache()
+        atexit.register(image_cache.evict)
+    return image_cache
+
+
+def export_snapshot(filename):
+    '''Pack the page cache, its parsed records and the image cache folder into
+    one SQLite snapshot file. Rows are written in key order, so the same caches
+    always give the same snapshot.
+        
+    Parameters
+    ----------
+    filename: str
+        The path of the snapshot file. An existing file is replaced.
     
+    Returns
+    -------
+    counts: dict
+        The number of pages, records and images in the snapshot.
+    '''
+    cache = get_page_cache()
+    cache.flush()
+    Path(filename).unlink(missing_ok = True)
+    snapshot = sqlite3.connect(filename)
+    snapshot.execute("""CREATE TABLE Pages (Url TEXT PRIMARY KEY, Body BLOB, ETag TEXT, LastModified TEXT,
+        Hash TEXT, FetchedAt REAL, Size INTEGER)""")
+    snapshot.execute("CREATE TABLE Records (Url TEXT, Kind TEXT, Hash TEXT, Version INTEGER, Data TEXT, PRIMARY KEY (Url, Kind))")
+    snapshot.execute("CREATE TABLE Images (Name TEXT PRIMARY KEY, Data BLOB)")
+    with cache.lock:
+        pages = cache.connection.execute(
+            "SELECT Url, Body, ETag, LastModified, Hash, FetchedAt, Size FROM Pages ORDER BY Url").fetchall()
+        records = cache.connection.execute("SELECT Url, Kind, Hash, Version, Data FROM Records ORDER BY Url, Kind").fetchall()
+    snapshot.executemany("INSERT INTO Pages VALUES(?, ?, ?, ?, ?, ?, ?)", pages)
+    snapshot.executemany("INSERT INTO Records VALUES(?, ?, ?, ?, ?)", records)
+
+    folder = get_image_cache().folder
+    names = sorted(path.name for path in folder.iterdir() if path.is_file()) if folder.exists() else []
+    snapshot.executemany("INSERT INTO Images VALUES(?, ?)", ((name, convert_to_binary(folder / name)) for name in names))
+    snapshot.commit()
+    snapshot.execute("VACUUM")
+    snapshot.close()
+    return {"pages": len(pages), "records": len(records), "images": len(names)}
+
+
+def import_snapshot(filename):
+    '''Load a snapshot written by export_snapshot into the page cache and the
+    image cache folder, replacing cached entries for the same urls and images.
+    Pages that are new or whose content differs from the cached copy are added
+    to the changed set of the cache, so a following update_data picks them up.
+    The snapshot is read through a memory map.
+        
     Parameters
     ----------
-    cache_dict: dict
-        The dictionary to save
+    filename: str
+        The path of the snapshot file.
     
     Returns
     -------
+    counts: dict
+        The number of pages, records and images loaded.
+    '''
+    if not Path(filename).exists():
+        raise FileNotFoundError(filename)
+    snapshot = sqlite3.connect(filename)
+    snapshot.execute(f"PRAGMA mmap_size = {SNAPSHOT_MMAP_SIZE}")
+    cache = get_page_cache()
+    cache.flush()
+    now = time.time()
+    pages = snapshot.execute("SELECT Url, Body, ETag, LastModified, Hash, FetchedAt, Size FROM Pages").fetchall()
+    records = snapshot.execute("SELECT Url, Kind, Hash, Version, Data FROM Records").fetchall()
+    with cache.lock:
+        cached = dict(cache.connection.execute("SELECT Url, Hash FROM Pages"))
+        cache.changed.update(page[0] for page in pages if cached.get(page[0]) != page[4])
+        cache.fresh.update(page[0] for page in pages)
+        cache.connection.executemany("INSERT OR REPLACE INTO Pages (Url, Body, ETag, LastModified, Hash, FetchedAt, Size, Accessed) "
+            "VALUES(?, ?, ?, ?, ?, ?, ?, ?)", (page + (now, ) for page in pages))
+        cache.connection.executemany("INSERT OR REPLACE INTO Records (Url, Kind, Hash, Version, Data) VALUES(?, ?, ?, ?, ?)", records)
+        cache.connection.commit()
+
+    folder = get_image_cache().folder
+    folder.mkdir(parents = True, exist_ok = True)
+    images = 0
+    for name, data in snapshot.execute("SELECT Name, Data FROM Images"):
+        (folder / name).write_bytes(data)
+        images += 1
+    snapshot.close()
+    return {"pages": len(pages), "records": len(records), "images": images}
+
+
+class HttpClient:
+    '''One shared requests.Session for all scraping.
+    Connections are kept alive in a pool, every request has a timeout,
+    transient errors are retried with jittered exponential backoff and
+    requests can be rate limited. At most per_host requests are in flight to
+    the same host at a time. Request counts and latencies are recorded per host.
+    An offline client refuses every request.
+    '''
+    def __init__(self, timeout = HTTP_TIMEOUT, retries = HTTP_RETRIES, backoff = HTTP_BACKOFF,
+                 rate_limit = HTTP_RATE_LIMIT, pool_size = FETCH_WORKERS, per_host = FETCH_PER_HOST, offline = False):
+        self.timeout = timeout
+        self.offline = offline
+        self.retries = retries
+        self.backoff = backoff
+        self.rate_limit = rate_limit
+        self.per_host = per_host
+        self.host_slots = {}
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections = pool_size, pool_maxsize = pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self.lock = threading.Lock()
+        self.next_slot = 0.0
+        self.stats = {}
+
+    def wait_for_slot(self):
+        '''Sleep until the rate limit allows the next request.'''
+        if not self.rate_limit:
+            return
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + 1 / self.rate_limit
+        time.sleep(slot - now)
+
+    def host_slot(self, url):
+        '''Return the semaphore that limits concurrent requests to the url's host.'''
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.host_slots:
+                self.host_slots[host] = threading.BoundedSemaphore(self.per_host)
+            return self.host_slots[host]
+
+    def record(self, url, key, latency = None):
+        '''Add one event to the stats of the url's host.'''
+        host = urlparse(url).netloc
+        with self.lock:
+            if host not in self.stats:
+                self.stats[host] = {"requests": 0, "errors": 0, "retries": 0, "bytes": 0, "latencies": []}
+            self.stats[host][key] += 1
+            if latency is not None:
+                self.stats[host]["latencies"].append(latency)
+
+    def get(self, url, headers = None):
+        '''GET the url, retrying connection errors and retryable status codes.
+            
+        Parameters
+        ----------
+        url: str
+            The url to be fetched.
+        headers: dict
+            Optional request headers.
+        
+        Returns
+        -------
+        response: requests.Response
+            The last response received. A retryable status code that persists
+            after the last retry raises requests.HTTPError instead.
+        '''
+        if self.offline:
+            raise requests.ConnectionError(f"Offline: {url} is not in the cache")
+        for attempt in range(self.retries + 1):
+            self.wait_for_slot()
+            start = time.perf_counter()
+            try:
+                with self.host_slot(url):
+                    response = self.session.get(url, headers = headers, timeout = self.timeout)
+            except requests.RequestException:
+                self.record(url, "errors", time.perf_counter() - start)
+                if attempt == self.retries:
+                    raise
+            else:
+                self.record(url, "requests", time.perf_counter() - start)
+                with self.lock:
+                    self.stats[urlparse(url).netloc]["bytes"] += len(response.content)
+                if response.status_code not in RETRY_STATUS:
+                    return response
+                if attempt == self.retries:
+                    response.raise_for_status()
+            self.record(url, "retries")
+            time.sleep(random.uniform(0, self.backoff * 2 ** attempt))
+
+    def summary(self):
+        '''Summarize the recorded stats.
+            
+        Parameters
+        ----------
+        None
+        
+        Returns
+        -------
+        summary: dict
+            Per host: number of requests, errors, retries, bytes, total and average latency.
+        '''
+        summary = {}
+        with self.lock:
+            for host, stats in self.stats.items():
+                latencies = sorted(stats["latencies"])
+                summary[host] = {
+                    "requests": stats["requests"],
+                    "errors": stats["errors"],
+                    "retries": stats["retries"],
+                    "bytes": stats["bytes"],
+                    "seconds": round(sum(latencies), 3),
+                    "avg_latency": round(sum(latencies) / len(latencies), 4) if latencies else None,
+                    "max_latency": round(latencies[-1], 4) if latencies else None,
+                }
+        return summary
+
+    def close(self):
+        '''Close the pooled connections.'''
+        self.session.close()
+
+
+http_client = None
+
+def get_http_client():
+    '''Return the shared HttpClient, creating it on first use.
+        
+    Parameters
+    ----------
     None
+    
+    Returns
+    -------
+    http_client: HttpClient
+        The client shared by all scrapers.
+    '''
+    global http_client
+    if http_client is None:
+        http_client = HttpClient(offline = OFFLINE)
+        atexit.register(http_client.close)
+    return http_client
+
+
+def revalidation_headers(entry):
+    '''Build the conditional request headers for a cached page.
+        
+    Parameters
+    ----------
+    entry: tuple
+        The (body, etag, last_modified) of the cached page, or None.
+    
+    Returns
+    -------
+    headers: dict
+        The If-None-Match and If-Modified-Since headers that apply.
+    '''
+    headers = {}
+    if entry is not None:
+        if entry[1]:
+            headers["If-None-Match"] = entry[1]
+        if entry[2]:
+            headers["If-Modified-Since"] = entry[2]
+    return headers
+
+
+def store_response(url, entry, response):
+    '''Store a fetched page in the page cache. A 304 response keeps the cached body,
+    and an error response raises requests.HTTPError without touching the cache.
+        
+    Parameters
+    ----------
+    url: str
+        The url of the page.
+    entry: tuple
+        The cached (body, etag, last_modified) of the page, or None.
+    response: requests.Response
+        The response of the (conditional) request.
+    
+    Returns
+    -------
+    text: str
+        The current body of the page.
+    '''
+    cache = get_page_cache()
+    if entry is not None and response.status_code == 304:
+        cache.fresh.add(url)
+        return entry[0]
+    response.raise_for_status()
+    cache.put(url, response.text, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+    return response.text
+
+
+def make_soup(text, scope = None, parser = None):
+    '''Parse a page with the fastest available parser, only keeping the scoped subtree.
+    Falls back to a full parse with html.parser if the scoped parse finds nothing.
+        
+    Parameters
+    ----------
+    text: str
+        The HTML of the page.
+    scope: str
+        A key of STRAINERS, or None to parse the whole document.
+    parser: str
+        The BeautifulSoup parser to use, HTML_PARSER by default.
+    
+    Returns
+    -------
+    soup: BeautifulSoup
+        The parsed page.
+    '''
+    strainer = STRAINERS[scope] if scope is not None else None
+    soup = BeautifulSoup(text, parser or HTML_PARSER, parse_only = strainer)
+    if strainer is not None and soup.find() is None:
+        soup = BeautifulSoup(text, "html.parser")
+    return soup
+
+
+def fetch_page(url, refresh = False):
+    '''Return the HTML of a page from the page cache, fetching it only if it is not cached.
+    With refresh, a cached page is revalidated with a conditional request once per run,
+    unless OFFLINE is set.
+        
+    Parameters
+    ----------
+    url: str
+        The url of the page.
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    text: str
+        The HTML of the page.
     '''
-    dumped_json_cache = json.dumps(cache_dict)
-    fw = open(CACHE_FILENAME,"w")
-    fw.write(dumped_json_cache)
-    fw.close()  
+    cache = get_page_cache()
+    entry = cache.get_entry(url)
+    if entry is None or (refresh and not OFFLINE and url not in cache.fresh):
+        #print("Fetching")
+        response = get_http_client().get(url, headers = revalidation_headers(entry))
+        return store_response(url, entry, response)
+    return entry[0]
 
 
-def cache_or_fetch(url):
+def cache_or_fetch(url, refresh = False, scope = None):
     '''Decide whether to use crawler or cache. Use the crawler only if the url is not in cache.
+    With refresh, a cached page is revalidated with a conditional request once per run.
         
     Parameters
     ----------
     url: str
         The url to be parsed by BS.
+    refresh: bool
+        Whether to revalidate cached pages.
+    scope: str
+        The part of the page to parse, a key of STRAINERS or None for the whole page.
     
     Returns
     -------
     soup: str
         The parsed result of the url.
     '''
-    cache_dict = open_cache()
-    if url in cache_dict.keys():
-        #print("Using Cache")
-        soup = BeautifulSoup(cache_dict[url], "html.parser")
-    else:
-        #print("Fetching")
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
-        cache_dict[url] = response.text
-        save_cache(cache_dict)
+    return make_soup(fetch_page(url, refresh), scope)
 
-    return soup
+
+def fetch_all(urls, headers = None, max_workers = None):
+    '''Fetch the urls concurrently with a bounded pool of worker threads.
+    The shared HttpClient limits the requests in flight per host.
+        
+    Parameters
+    ----------
+    urls: list
+        The urls to be fetched.
+    headers: list
+        Optional request headers for each url.
+    max_workers: int
+        The size of the worker pool, FETCH_WORKERS by default.
+    
+    Returns
+    -------
+    responses: list
+        The responses, in the same order as urls.
+    '''
+    client = get_http_client()
+    if not urls:
+        return []
+    if headers is None:
+        headers = [{}] * len(urls)
+    with ThreadPoolExecutor(max_workers = min(max_workers or FETCH_WORKERS, len(urls))) as executor:
+        return list(executor.map(lambda url, url_headers: client.get(url, headers = url_headers), urls, headers))
+
+
+def iter_fetch(urls, refresh = False, window = STREAM_WINDOW):
+    '''Yield the HTML of every url in order, fetching up to window pages ahead
+    on the worker pool while the caller works on the earlier ones.
+        
+    Parameters
+    ----------
+    urls: list
+        The urls of the pages.
+    refresh: bool
+        Whether to revalidate cached pages.
+    window: int
+        How many pages may be fetched ahead of the caller.
+    
+    Returns
+    -------
+    texts: generator
+        The HTML of the pages, in the same order as urls.
+    '''
+    pending = deque()
+    with ThreadPoolExecutor(max_workers = FETCH_WORKERS) as executor:
+        for url in urls:
+            pending.append(executor.submit(fetch_page, url, refresh))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def prefetch_pages(urls, refresh = False):
+    '''Concurrently fetch the pages that are not in the page cache yet and cache them,
+    so the following cache_or_fetch calls are all cache hits.
+    With refresh, cached pages are revalidated with conditional requests as well.
+        
+    Parameters
+    ----------
+    urls: list
+        The urls of the pages.
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    None
+    '''
+    cache = get_page_cache()
+    entries = {url: cache.get_entry(url) for url in dict.fromkeys(urls)}
+    targets = [url for url, entry in entries.items() if entry is None or (refresh and not OFFLINE and url not in cache.fresh)]
+    headers = [revalidation_headers(entries[url]) for url in targets]
+    for url, response in zip(targets, fetch_all(targets, headers)):
+        store_response(url, entries[url], response)
 
 
-def get_NPCs():
-    '''Parse all NPC information
+def download_images(img_urls):
+    '''Concurrently download the images that are not in the image cache folder yet.
         
     Parameters
     ----------
+    img_urls: list
+        The urls of the images. The file name is the last part of the url.
+    
+    Returns
+    -------
     None
+    '''
+    get_image_cache().download(img_urls)
+
+
+def parse_NPC_index(soup):
+    '''Parse the NPC index page.
+        
+    Parameters
+    ----------
+    soup: BeautifulSoup
+        The parsed NPC index page.
     
     Returns
     -------
-    NPC_list: list
-        A list of NPC instances.
+    NPC_index: list
+        (name, url, image url) of every NPC, in page order.
     '''
-    soup = cache_or_fetch(NPC_url)
     content = soup.find("div", id = "wiki-content-block")
     rows = content.find_all("div", class_ = "row")
-    NPC_url_dict = {}
-    NPC_img_dict = {}
-    NPC_list = []
-    p = Path("img_cache")
-    p.mkdir(parents = True, exist_ok = True)
+    NPC_index = []
 
     for row in rows:
         columns = row.find_all("div", class_ = "col-sm-4")
         for column in columns:
             img_url = base_url + column.find("img")["src"]
-            img_name = img_url.split('/')[-1]
-            if not (p / img_name).exists():
-                response = requests.get(img_url)
-                (p / img_name).open("wb").write(response.content)
-
             character = column.find("h3", style = "text-align: center;").find("a")
             href = character["href"]
             name = character.text.strip()
-            NPC_url_dict[name] = base_url + href
-            NPC_img_dict[name] = img_name
-
-    for name, url in NPC_url_dict.items():
-        soup = cache_or_fetch(url)
-        table_info = soup.find("table", class_ = "wiki_table")
-        if "Male" in table_info.text:
-            gender = "Male"
-        elif "Female" in table_info.text:
-            gender = "Female"
-        else:
-            gender = None
+            NPC_index.append((name, base_url + href, img_url))
+    return NPC_index
 
-        info = soup.find("div", id = "wiki-content-block").find("p").text.strip().replace(u'\xa0', u' ')
 
-        NPC_list.append(NPC(url, name, info, gender, NPC_img_dict[name]))
-    
-    #for npc in NPC_list:
-    #    print(npc)
-    return NPC_list
+def parse_NPC_page(soup):
+    '''Parse an NPC detail page.
+        
+    Parameters
+    ----------
+    soup: BeautifulSoup
+        The parsed NPC page.
     
+    Returns
+    -------
+    NPC_info: tuple
+        (info, gender) of the NPC.
+    '''
+    table_info = soup.find("table", class_ = "wiki_table")
+    if "Male" in table_info.text:
+        gender = "Male"
+    elif "Female" in table_info.text:
+        gender = "Female"
+    else:
+        gender = None
 
-def get_locations():
-    '''Parse all location information
+    info = soup.find("div", id = "wiki-content-block").find("p").text.strip().replace(u'\xa0', u' ')
+    return (info, gender)
+
+
+def parse_location_index(soup):
+    '''Parse the location index page.
         
     Parameters
     ----------
-    None
+    soup: BeautifulSoup
+        The parsed location index page.
     
     Returns
     -------
-    location_list: list
-        A list of location instances.
+    location_index: list
+        (name, url) of every location, in page order.
     '''
-    soup = cache_or_fetch(location_url)
     content = soup.find("div", id = "wiki-content-block")
     rows = content.find_all("div", class_ = "row")
-    location_url_dict = {}
-    location_list = []
+    location_index = []
 
     for row in rows:
         columns = row.find_all("div", class_ = "col-sm-4")
@@ -216,48 +1098,51 @@ def get_locations():
                 name = "Battle Arena"
             if href == "/Battle+Arena+(DLC)":
                 href = "/Battle+Arena"
-            location_url_dict[name] = base_url + href
+            location_index.append((name, base_url + href))
+    return location_index
 
-    for name, url in location_url_dict.items():
-        response = requests.get(url)
-        soup = BeautifulSoup(response.text, "html.parser")
 
-        info = soup.find("div", id = "wiki-content-block").find("p").text.strip().replace(u'\xa0', u' ')
-
-        table = soup.find("div", class_ = "col-sm-4 col-md-3 col-md-push-9")
-        previous_location = table.find_all("li")[0].text.split(":")[-1].strip()
-        if previous_location.lower() in none_list:
-            previous_location = None
+def parse_location_page(soup):
+    '''Parse a location detail page.
         
-        next_location = table.find_all("li")[1].text.split(":")[-1].strip()
-        if next_location.lower() in none_list:
-            next_location = None
-
-        if name == "Bunker":
-            name = "The Bunker"
-
-        location_list.append(Location(url, name, info, previous_location, next_location))
+    Parameters
+    ----------
+    soup: BeautifulSoup
+        The parsed location page.
+    
+    Returns
+    -------
+    location_info: tuple
+        (info, previous location, next location) of the location.
+    '''
+    info = soup.find("div", id = "wiki-content-block").find("p").text.strip().replace(u'\xa0', u' ')
 
-    #for l in location_list:
-    #    print(l)
-    return location_list
+    table = soup.find("div", class_ = "col-sm-4 col-md-3 col-md-push-9")
+    previous_location = table.find_all("li")[0].text.split(":")[-1].strip()
+    if previous_location.lower() in none_list:
+        previous_location = None
+    
+    next_location = table.find_all("li")[1].text.split(":")[-1].strip()
+    if next_location.lower() in none_list:
+        next_location = None
+    return (info, previous_location, next_location)
 
 
-def get_main_quests():
-    '''Parse all main quest information
+def parse_main_quests(soup):
+    '''Parse the main quest page.
         
     Parameters
     ----------
-    None
+    soup: BeautifulSoup
+        The parsed main quest page.
     
     Returns
     -------
-    main_quest_list: list
-        A list of quest instances whose category is set to "main".
+    main_quests: list
+        (url, name, giver, location, reward, category) of every main quest.
     '''
-    soup = cache_or_fetch(main_quest_url)
     tables = soup.find_all("table", class_ = "wiki_table")
-    main_quest_list = []
+    main_quests = []
     
     for table in tables[0:2]:
         rows = table.find("tbody").find_all("tr")
@@ -276,7 +1161,7 @@ def get_main_quests():
             reward = columns[3].text.strip().replace(u'\xa0', u' ')
             if reward in none_list:
                 reward = None
-            main_quest_list.append(Quest(url, name, giver, location, reward, "main"))
+            main_quests.append((url, name, giver, location, reward, "main"))
     
     rows = tables[2].find("tbody").find_all("tr")
     for row in rows:
@@ -286,28 +1171,25 @@ def get_main_quests():
         giver = None
         location = columns[1].text.strip()
         reward = None
-        main_quest_list.append(Quest(url, name, giver, location, reward, "main"))
-
-    #for q in main_quest_list:
-    #    print(q)
-    return main_quest_list
+        main_quests.append((url, name, giver, location, reward, "main"))
+    return main_quests
 
 
-def get_side_quests():
-    '''Parse all main quest information
+def parse_side_quests(soup):
+    '''Parse the side quest page.
         
     Parameters
     ----------
-    None
+    soup: BeautifulSoup
+        The parsed side quest page.
     
     Returns
     -------
-    side_quest_list: list
-        A list of quest instances whose category is set to "side".
+    side_quests: list
+        (url, name, giver, location, reward, category) of every side quest.
     '''
-    soup = cache_or_fetch(side_quest_url)
     rows = soup.find("table", class_ = "wiki_table sortable").find("tbody").find_all("tr")
-    side_quest_list = []
+    side_quests = []
 
     for row in rows:
         columns = row.find_all("td")
@@ -330,74 +1212,1211 @@ def get_side_quests():
         reward = columns[2].text.strip().replace("\n", ", ").replace(u'\xa0', u' ')
         if reward in none_list:
             reward = None
-        side_quest_list.append(Quest(url, name, giver, location, reward, "side"))
+        side_quests.append((url, name, giver, location, reward, "side"))
+    return side_quests
 
-    #for q in side_quest_list:
-    #    print(q)
-    return side_quest_list
 
+def parse_fishes(soup):
+    '''Parse the fishing page.
+        
+    Parameters
+    ----------
+    soup: BeautifulSoup
+        The parsed fishing page.
+    
+    Returns
+    -------
+    fishes: list
+        (url, name, location, image url, price) of every fish.
+    '''
+    rows = soup.find("table", class_ = "wiki_table").find("tbody").find_all("tr")
+    fishes = []
+
+    for row in rows:
+        columns = row.find_all("td")
 
-def get_fishes():
-    '''Parse all fish information
+        img_url = base_url + columns[0].find("img")["src"]
+        name = columns[0].find_all("a")[-1].text.strip()
+        url = base_url + columns[0].find("a")["href"]
+        price = columns[1].find_all("p")[-1].text.strip()
+        price = int(price.strip("G").replace(",", ""))
+        location = columns[2].text.strip().replace("\n", ", ").replace(u'\xa0', u' ')
+        fishes.append((url, name, location, img_url, price))
+    return fishes
+
+
+# Page kind: (parse function, strainer scope, entity type). The entity type
+# selects the version in PARSER_VERSIONS.
+PAGE_PARSERS = {
+    "NPC index": (parse_NPC_index, "content", "NPC"),
+    "NPC": (parse_NPC_page, "content", "NPC"),
+    "Location index": (parse_location_index, "content", "Location"),
+    "Location": (parse_location_page, "content", "Location"),
+    "Main quests": (parse_main_quests, "tables", "Quest"),
+    "Side quests": (parse_side_quests, "tables", "Quest"),
+    "Fishes": (parse_fishes, "tables", "Fish"),
+}
+
+
+def parse_page(url, kind, refresh = False, text = None):
+    '''Get the parsed records of a page, from the record cache when possible.
+    Records are cached by url and page kind together with the content hash of
+    the page and the parser version of the entity type, so a page is only
+    parsed again if its content or the parser for its entity type changed.
+        
+    Parameters
+    ----------
+    url: str
+        The url of the page.
+    kind: str
+        The kind of page, a key of PAGE_PARSERS.
+    refresh: bool
+        Whether to revalidate the cached page.
+    text: str
+        The HTML of the page if it was already fetched, None to fetch it.
+    
+    Returns
+    -------
+    records: tuple or list
+        The result of the parse function of the page kind.
+    '''
+    cache = get_page_cache()
+    if text is None:
+        text = fetch_page(url, refresh)
+    parse, scope, entity = PAGE_PARSERS[kind]
+    digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+    records = cache.get_records(url, kind, digest, PARSER_VERSIONS[entity])
+    if records is None:
+        records = parse_text(kind, text)
+        cache.put_records(url, kind, digest, PARSER_VERSIONS[entity], records)
+    return records
+
+
+def parse_text(kind, text):
+    '''Parse the HTML of a page of the given kind. Runs in the parse worker processes,
+    so it only takes and returns plain values. If the parser does not find what it
+    needs in the scoped subtree, e.g. a sidebar outside the content block, the
+    page is parsed again in full.
+        
+    Parameters
+    ----------
+    kind: str
+        The kind of page, a key of PAGE_PARSERS.
+    text: str
+        The HTML of the page.
+    
+    Returns
+    -------
+    records: tuple or list
+        The result of the parse function of the page kind.
+    '''
+    parse, scope, entity = PAGE_PARSERS[kind]
+    try:
+        return parse(make_soup(text, scope))
+    except (AttributeError, IndexError, TypeError):
+        if scope is None:
+            raise
+        return parse(make_soup(text))
+
+
+def iter_parse(urls, kind, refresh = False, workers = None):
+    '''Yield the parsed records of pages of one kind, in the order of urls.
+    With more than one worker, pages missing from the record cache are parsed
+    in a process pool while the following pages are fetched; otherwise every
+    page goes through parse_page in this process. The pool starts its workers
+    from a fork server, so a script that uses it needs an
+    if __name__ == "__main__" guard.
+        
+    Parameters
+    ----------
+    urls: list
+        The urls of the pages.
+    kind: str
+        The kind of page, a key of PAGE_PARSERS.
+    refresh: bool
+        Whether to revalidate cached pages.
+    workers: int
+        The number of parse processes, PARSE_WORKERS by default and 0 for one per core.
+    
+    Returns
+    -------
+    records: generator
+        The parsed records of every page.
+    '''
+    if workers is None:
+        workers = PARSE_WORKERS
+    if workers == 0:
+        workers = os.cpu_count() or 1
+    texts = iter_fetch(urls, refresh)
+    if workers <= 1:
+        for url, text in zip(urls, texts):
+            yield parse_page(url, kind, refresh, text)
+        return
+
+    cache = get_page_cache()
+    version = PARSER_VERSIONS[PAGE_PARSERS[kind][2]]
+    executor = None
+    pending = deque()
+    try:
+        for url, text in zip(urls, texts):
+            digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+            records = cache.get_records(url, kind, digest, version)
+            if records is None:
+                if executor is None:
+                    # This runs in the producer thread of stream_data, and forking a
+                    # process with threads can copy held locks into the workers.
+                    executor = ProcessPoolExecutor(max_workers = workers, mp_context = multiprocessing.get_context("forkserver"),
+                                                   initializer = set_base_url, initargs = (base_url, ))
+                records = executor.submit(parse_text, kind, text)
+            pending.append((url, digest, records))
+            while len(pending) > STREAM_WINDOW or (pending and not hasattr(pending[0][2], "result")):
+                yield finish_parse(cache, kind, version, *pending.popleft())
+        while pending:
+            yield finish_parse(cache, kind, version, *pending.popleft())
+    finally:
+        if executor is not None:
+            executor.shutdown(cancel_futures = True)
+
+
+def finish_parse(cache, kind, version, url, digest, records):
+    '''Wait for a page parsed by iter_parse and store its records in the record cache.'''
+    if hasattr(records, "result"):
+        records = records.result()
+        cache.put_records(url, kind, digest, version, records)
+    return records
+
+
+def iter_NPCs(refresh = False):
+    '''Yield NPC rows as soon as their detail page is parsed.
+    The detail pages are fetched ahead of the parser and parsed by iter_parse.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    rows: generator
+        (url, name, info, gender, img_name) of every NPC.
+    '''
+    NPC_url_dict = {}
+    NPC_img_dict = {}
+    img_urls = []
+
+    for name, url, img_url in parse_page(NPC_url, "NPC index", refresh):
+        img_urls.append(img_url)
+        NPC_url_dict[name] = url
+        NPC_img_dict[name] = img_url.split('/')[-1]
+
+    download_images(img_urls)
+    pages = iter_parse(list(NPC_url_dict.values()), "NPC", refresh)
+    for (name, url), (info, gender) in zip(NPC_url_dict.items(), pages):
+        yield (url, name, info, gender, NPC_img_dict[name])
+
+
+def iter_locations(refresh = False):
+    '''Yield location rows as soon as their detail page is parsed.
+    The detail pages are fetched ahead of the parser and parsed by iter_parse.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    rows: generator
+        (url, name, info, previous_location, next_location) of every location.
+    '''
+    location_url_dict = dict(parse_page(location_url, "Location index", refresh))
+
+    pages = iter_parse(list(location_url_dict.values()), "Location", refresh)
+    for (name, url), (info, previous_location, next_location) in zip(location_url_dict.items(), pages):
+
+        if name == "Bunker":
+            name = "The Bunker"
+
+        yield (url, name, info, previous_location, next_location)
+
+
+def iter_main_quests(refresh = False):
+    '''Yield main quest rows.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    rows: generator
+        (url, name, giver, location, reward, category) of every main quest.
+    '''
+    for quest in parse_page(main_quest_url, "Main quests", refresh):
+        yield tuple(quest)
+
+
+def iter_side_quests(refresh = False):
+    '''Yield side quest rows.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    rows: generator
+        (url, name, giver, location, reward, category) of every side quest.
+    '''
+    for quest in parse_page(side_quest_url, "Side quests", refresh):
+        yield tuple(quest)
+
+
+def iter_fishes(refresh = False):
+    '''Yield fish rows once their images are downloaded.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    rows: generator
+        (url, name, location, img_name, price) of every fish.
+    '''
+    fishes = parse_page(fish_url, "Fishes", refresh)
+    download_images([img_url for url, name, location, img_url, price in fishes])
+    for url, name, location, img_url, price in fishes:
+        yield (url, name, location, img_url.split('/')[-1], price)
+
+
+def get_NPCs(refresh = False):
+    '''Parse all NPC information
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    NPC_list: RecordBatch
+        A batch of NPC records.
+    '''
+    NPC_list = RecordBatch(NPC)
+    for row in iter_NPCs(refresh):
+        NPC_list.add(*row)
+    
+    #for npc in NPC_list:
+    #    print(npc)
+    return NPC_list
+    
+
+def get_locations(refresh = False):
+    '''Parse all location information
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    location_list: RecordBatch
+        A batch of location records.
+    '''
+    location_list = RecordBatch(Location)
+    for row in iter_locations(refresh):
+        location_list.add(*row)
+
+    #for l in location_list:
+    #    print(l)
+    return location_list
+
+
+def get_main_quests(refresh = False):
+    '''Parse all main quest information
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    main_quest_list: RecordBatch
+        A batch of quest records whose category is set to "main".
+    '''
+    main_quest_list = RecordBatch(Quest)
+    for quest in iter_main_quests(refresh):
+        main_quest_list.add(*quest)
+
+    #for q in main_quest_list:
+    #    print(q)
+    return main_quest_list
+
+
+def get_side_quests(refresh = False):
+    '''Parse all main quest information
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    side_quest_list: RecordBatch
+        A batch of quest records whose category is set to "side".
+    '''
+    side_quest_list = RecordBatch(Quest)
+    for quest in iter_side_quests(refresh):
+        side_quest_list.add(*quest)
+
+    #for q in side_quest_list:
+    #    print(q)
+    return side_quest_list
+
+
+def get_fishes(refresh = False):
+    '''Parse all fish information
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    fish_list: RecordBatch
+        A batch of fish records.
+    '''
+    fish_list = RecordBatch(Fish)
+    for row in iter_fishes(refresh):
+        fish_list.add(*row)
+
+    #for f in fish_list:
+    #    print(f)
+    return fish_list
+
+
+def stream_records(refresh = False):
+    '''Yield every scraped record in load order: NPCs, locations, main and
+    side quests, then fishes.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate cached pages.
+    
+    Returns
+    -------
+    records: generator
+        (record type, row) pairs, the row in the field order of the record type.
+    '''
+    stages = [(NPC, iter_NPCs), (Location, iter_locations), (Quest, iter_main_quests),
+              (Quest, iter_side_quests), (Fish, iter_fishes)]
+    for record_type, stage in stages:
+        for row in stage(refresh):
+            yield (record_type, row)
+
+
+def convert_to_binary(filename):
+    '''Convert jpg image to binary in order to store in database.
+        
+    Parameters
+    ----------
+    filename: str
+        The path of the image file to be converted.
+    
+    Returns
+    -------
+    blob_data: str
+        The binary string of the image.
+    '''
+    with open(filename, 'rb') as file:
+        blob_data = file.read()
+    return blob_data
+
+
+def image_type(data):
+    '''Detect the MIME type of image bytes from their leading bytes.
+        
+    Parameters
+    ----------
+    data: bytes
+        The image, or at least its first few bytes.
+    
+    Returns
+    -------
+    mime: str
+        The MIME type, "application/octet-stream" if it is not recognized.
+    extension: str
+        The usual file extension of the type, ".bin" if it is not recognized.
+    '''
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp", ".webp"
+    head = data[:64].lstrip()
+    for signature, mime, extension in IMAGE_SIGNATURES:
+        if head[:len(signature)] == signature:
+            return mime, extension
+    return "application/octet-stream", ".bin"
+
+
+def make_thumbnails(data):
+    '''Scale an image down to every size in THUMBNAIL_SIZES, keeping its aspect ratio.
+    Needs Pillow. Images with transparency become PNG thumbnails, all others JPEG.
+    Sizes that would not be smaller than the original are skipped.
+        
+    Parameters
+    ----------
+    data: bytes
+        The original image.
+    
+    Returns
+    -------
+    thumbnails: list
+        (size, mime, bytes) of every thumbnail. Empty without Pillow or for
+        images Pillow cannot read.
+    '''
+    if not THUMBNAILS:
+        return []
+    thumbnails = []
+    try:
+        original = PILImage.open(io.BytesIO(data))
+        original.load()
+    except:
+        return []
+    alpha = original.mode in ("RGBA", "LA") or (original.mode == "P" and "transparency" in original.info)
+    for size in THUMBNAIL_SIZES:
+        image = original.copy()
+        image.thumbnail((size, size))
+        buffer = io.BytesIO()
+        if alpha:
+            image.convert("RGBA").save(buffer, format = "PNG", optimize = True)
+            mime = "image/png"
+        else:
+            image.convert("RGB").save(buffer, format = "JPEG", quality = THUMBNAIL_QUALITY, optimize = True)
+            mime = "image/jpeg"
+        if buffer.tell() < len(data):
+            thumbnails.append((size, mime, buffer.getvalue()))
+    return thumbnails
+
+
+def store_image_metadata(cursor, image_id, data):
+    '''Store the MIME type and the thumbnails of an image.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    image_id: int
+        The Id of the image in Images.
+    data: bytes
+        The original image.
+    
+    Returns
+    -------
+    None
+    '''
+    cursor.execute("UPDATE Images SET Mime = ? WHERE Id = ?", (image_type(data)[0], image_id))
+    cursor.executemany("INSERT OR REPLACE INTO Thumbnails ('Image', 'Size', 'Mime', 'Data') VALUES(?, ?, ?, ?)",
+        [(image_id, size, mime, thumbnail) for size, mime, thumbnail in make_thumbnails(data)])
+
+
+def store_images(cursor, img_names):
+    '''Store image files in the content-addressed Images table.
+    Every image is keyed by the SHA-256 of its bytes, so identical images
+    are stored once no matter how many rows refer to them. New images get
+    their MIME type and thumbnails when they are stored.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    img_names: list
+        The file names of the images in the image cache folder.
+    
+    Returns
+    -------
+    image_ids: dict
+        The file name to the Id of its row in Images.
+    '''
+    p = get_image_cache().folder
+    ids = {}
+    for img_name in dict.fromkeys(img_names):
+        ids[img_name] = store_image(cursor, convert_to_binary(p / img_name))
+    return ids
+
+
+def store_image(cursor, blob_data):
+    '''Store one image in the content-addressed Images table, with its MIME
+    type and thumbnails if it is new.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    blob_data: bytes
+        The image.
+    
+    Returns
+    -------
+    image_id: int
+        The Id of its row in Images.
+    '''
+    digest = hashlib.sha256(blob_data).hexdigest()
+    cursor.execute("INSERT OR IGNORE INTO Images ('Hash', 'Data') VALUES(?, ?)", (digest, blob_data))
+    if cursor.rowcount == 1:
+        store_image_metadata(cursor, cursor.lastrowid, blob_data)
+    return cursor.execute("SELECT Id FROM Images WHERE Hash = ?", (digest, )).fetchone()[0]
+
+
+def backfill_image_metadata(cursor):
+    '''Store the MIME type and thumbnails of images stored before they existed.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    None
+    '''
+    for image_id, data in cursor.execute("SELECT Id, Data FROM Images WHERE Mime IS NULL").fetchall():
+        store_image_metadata(cursor, image_id, data)
+
+
+def find_image(connection, image_id, size = None):
+    '''Find the stored version of an image to read: the smallest thumbnail
+    that is at least size pixels, or the original.
+        
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        The database connection.
+    image_id: int
+        The Id of the image.
+    size: int
+        The wanted size, None or 0 for the original.
+    
+    Returns
+    -------
+    image: tuple
+        (table, rowid, length, mime) of the stored version, or None if there is no such image.
+    '''
+    if size:
+        row = connection.execute("SELECT Id, length(Data), Mime FROM Thumbnails WHERE Image = ? AND Size >= ? ORDER BY Size LIMIT 1",
+            (image_id, size)).fetchone()
+        if row is not None:
+            return ("Thumbnails", row[0], row[1], row[2])
+    row = connection.execute("SELECT length(Data), Mime FROM Images WHERE Id = ?", (image_id, )).fetchone()
+    if row is None:
+        return None
+    return ("Images", image_id, row[0], row[1])
+
+
+def read_images(image_ids, size = None):
+    '''Read image bytes from the Images table with incremental blob I/O.
+        
+    Parameters
+    ----------
+    image_ids: list
+        The Ids of the images. None entries and Ids that are not in Images are skipped.
+    size: int
+        Read the smallest thumbnail of at least this size where there is one,
+        None for the originals.
+    
+    Returns
+    -------
+    images: list
+        The bytes of every image.
+    '''
+    images = []
+    with get_query_pool().connection() as connection:
+        for image_id in image_ids:
+            if image_id is None:
+                continue
+            image = find_image(connection, image_id, size)
+            if image is None:
+                continue
+            table, rowid, length, mime = image
+            if hasattr(connection, "blobopen"):
+                with connection.blobopen(table, "Data", rowid, readonly = True) as blob:
+                    images.append(blob.read())
+            else:
+                images.append(connection.execute(f"SELECT Data FROM {table} WHERE Id = ?", (rowid, )).fetchone()[0])
+    return images
+
+
+def create_tables():
+    '''Create all database tables.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    None
+    '''
+    connection = sqlite3.connect(DBNAME)
+    cursor = connection.cursor()
+
+    create_image = '''CREATE TABLE IF NOT EXISTS Images (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
+    Hash TEXT NOT NULL UNIQUE, Data BLOB, Mime TEXT)'''
+    cursor.execute(create_image)
+    if "Mime" not in [row[1] for row in cursor.execute("PRAGMA table_info(Images)")]:
+        cursor.execute("ALTER TABLE Images ADD COLUMN Mime TEXT")
+
+    create_thumbnail = '''CREATE TABLE IF NOT EXISTS Thumbnails (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
+    Image INTEGER, Size INTEGER, Mime TEXT, Data BLOB, UNIQUE(Image, Size),
+    FOREIGN KEY(Image) REFERENCES Images(Id))'''
+    cursor.execute(create_thumbnail)
+
+    create_NPC = '''CREATE TABLE IF NOT EXISTS NPCs (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
+    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Info TEXT, Gender TEXT, ImageId INTEGER,
+    FOREIGN KEY(ImageId) REFERENCES Images(Id))'''
+    cursor.execute(create_NPC)
+
+    create_location = '''CREATE TABLE IF NOT EXISTS Locations (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
+    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE COLLATE NOCASE, Info TEXT, PreviousLocation TEXT, NextLocation TEXT)'''
+    cursor.execute(create_location)
+
+    create_quest = '''CREATE TABLE IF NOT EXISTS Quests (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
+    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Giver TEXT COLLATE NOCASE, Location INTEGER, Reward TEXT COLLATE NOCASE, Category TEXT,
+    FOREIGN KEY(Location) REFERENCES Locations(Id))'''
+    cursor.execute(create_quest)
+
+    create_fish = '''CREATE TABLE IF NOT EXISTS Fishes (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
+    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Location TEXT COLLATE NOCASE, Price INTEGER, ImageId INTEGER,
+    FOREIGN KEY(ImageId) REFERENCES Images(Id))'''
+    cursor.execute(create_fish)
+
+    create_fishing_location = '''CREATE TABLE IF NOT EXISTS FishingLocation (Fish INTEGER, Location INTEGER,
+    FOREIGN KEY(Fish) REFERENCES Fishes(Id), FOREIGN KEY(Location) REFERENCES Locations(Id))'''
+    cursor.execute(create_fishing_location)
+
+    for table, (search_table, columns) in SEARCH_TABLES.items():
+        create_search = f'''CREATE VIRTUAL TABLE IF NOT EXISTS {search_table} USING fts5({', '.join(columns)},
+        content='{table}', content_rowid='Id', tokenize='trigram')'''
+        try:
+            cursor.execute(create_search)
+        except sqlite3.OperationalError:
+            # SQLite without FTS5 or the trigram tokenizer (before 3.34): text filters fall back to LIKE
+            break
+
+    for stats_table, (key, query, filter_column, sources) in STATS_TABLES.items():
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {stats_table} ({key} INTEGER PRIMARY KEY, Name TEXT, Value)")
+
+    connection.commit()
+    connection.close()
+
+
+def name_tokens(text):
+    '''Split a name into lowercase word tokens, dropping punctuation.
+        
+    Parameters
+    ----------
+    text: str
+        The name or text to be split.
+    
+    Returns
+    -------
+    tokens: list
+        The lowercase alphanumeric tokens of the text.
+    '''
+    return re.findall(r"[a-z0-9]+", text.lower())
+
+
+class LocationIndex:
+    '''Resolves location names to location ids.
+    Names are normalized to their tokens and kept in a dict, so an exact
+    lookup is a single dict access. Free text such as Fish.location is scanned
+    token by token, taking the longest location name that starts at each
+    token, so "Desert Housing" never also links "Desert".
+    '''
+    def __init__(self, location_rows):
+        self.ids = {}
+        self.longest = 1
+        for location_id, name in location_rows:
+            tokens = name_tokens(name)
+            key = " ".join(tokens)
+            if key and key not in self.ids:
+                self.ids[key] = location_id
+                self.longest = max(self.longest, len(tokens))
+
+    def resolve(self, name):
+        '''Return the id of the location with the given name, or None.'''
+        if name is None:
+            return None
+        return self.ids.get(" ".join(name_tokens(name)))
+
+    def find_all(self, text):
+        '''Return the ids of all locations mentioned in the text, in order of appearance.'''
+        tokens = name_tokens(text or "")
+        found = []
+        i = 0
+        while i < len(tokens):
+            for n in range(min(self.longest, len(tokens) - i), 0, -1):
+                location_id = self.ids.get(" ".join(tokens[i:i + n]))
+                if location_id is not None:
+                    if location_id not in found:
+                        found.append(location_id)
+                    i += n
+                    break
+            else:
+                i += 1
+        return found
+
+
+def fishing_links(fish_rows, location_index):
+    '''Match the fishes to the locations mentioned in their location text.
+        
+    Parameters
+    ----------
+    fish_rows: list
+        (Fish id, location text) of every fish.
+    location_index: LocationIndex
+        The index over all locations.
+    
+    Returns
+    -------
+    links: list
+        (Fish id, Location id) of every fishing location.
+    '''
+    links = []
+    for fish_id, fish_location in fish_rows:
+        for location_id in location_index.find_all(fish_location):
+            links.append((fish_id, location_id))
+    return links
+
+
+def insert_data(refresh = False):
+    '''Insert all database data.
+        
+    Parameters
+    ----------
+    refresh: bool
+        Whether to revalidate the cached pages before parsing them.
+    
+    Returns
+    -------
+    None
+    '''
+    stream_data(refresh)
+    get_page_cache().flush()
+
+
+def create_indexes(cursor):
+    '''Create the secondary indexes and the triggers that keep the search
+    and stats tables in sync with later updates. Called after a bulk load, so
+    the indexes are built once instead of being updated row by row.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    None
+    '''
+    for statement in INDEXES:
+        cursor.execute(statement)
+
+    for table, (search_table, columns) in search_tables(cursor).items():
+        names = ", ".join(columns)
+        new_values = ", ".join("new." + column for column in columns)
+        old_values = ", ".join("old." + column for column in columns)
+        insert = f"INSERT INTO {search_table} (rowid, {names}) VALUES(new.Id, {new_values});"
+        delete = f"INSERT INTO {search_table} ({search_table}, rowid, {names}) VALUES('delete', old.Id, {old_values});"
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {search_table}Insert AFTER INSERT ON {table} BEGIN {insert} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {search_table}Delete AFTER DELETE ON {table} BEGIN {delete} END")
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {search_table}Update AFTER UPDATE ON {table} BEGIN {delete} {insert} END")
+
+    for stats_table in STATS_TABLES:
+        cursor.execute(f"CREATE INDEX IF NOT EXISTS {stats_table}ValueIndex ON {stats_table} (Value)")
+    sources = {}
+    for stats_table, (key, query, filter_column, tables) in STATS_TABLES.items():
+        for table, keys in tables.items():
+            sources.setdefault(table, []).append((stats_table, keys))
+    for table, targets in sources.items():
+        for event, rows in [("Insert", ["new"]), ("Delete", ["old"]), ("Update", ["old", "new"])]:
+            body = " ".join(refresh_stats(stats_table, " UNION ".join(keys.format(row = row) for row in rows))
+                            for stats_table, keys in targets)
+            cursor.execute(f"CREATE TRIGGER IF NOT EXISTS {table}Stats{event} AFTER {event.upper()} ON {table} BEGIN {body} END")
+
+
+def search_tables(cursor):
+    '''Return the search tables that exist in the database.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    search_tables: dict
+        The items of SEARCH_TABLES whose search table was created.
+    '''
+    existing = {row[0] for row in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    return {table: value for table, value in SEARCH_TABLES.items() if value[0] in existing}
+
+
+def rebuild_search(cursor):
+    '''Rebuild the full text search tables from their content tables.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    None
+    '''
+    for search_table, columns in search_tables(cursor).values():
+        cursor.execute(f"INSERT INTO {search_table} ({search_table}) VALUES('rebuild')")
+
+
+def refresh_stats(stats_table, keys = None):
+    '''Build the statements that recompute rows of a stats table.
+        
+    Parameters
+    ----------
+    stats_table: str
+        A key of STATS_TABLES.
+    keys: str
+        A query selecting the keys to recompute, None for all of them.
+    
+    Returns
+    -------
+    statements: str
+        The DELETE and INSERT statements, separated by semicolons.
+    '''
+    key, query, filter_column, sources = STATS_TABLES[stats_table]
+    if keys is None:
+        delete = f"DELETE FROM {stats_table};"
+        select = query.format(filter = "1")
+    else:
+        delete = f"DELETE FROM {stats_table} WHERE {key} IN ({keys});"
+        select = query.format(filter = f"{filter_column} IN ({keys})")
+    return f"{delete} INSERT INTO {stats_table} ({key}, Name, Value) {select};"
+
+
+def rebuild_stats(cursor):
+    '''Recompute every stats table from scratch.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    None
+    '''
+    for stats_table in STATS_TABLES:
+        for statement in refresh_stats(stats_table).split(";")[:-1]:
+            cursor.execute(statement)
+
+
+def bump_data_version(cursor):
+    '''Stamp the database with a new data version in PRAGMA user_version, inside
+    the current transaction. Query caches compare this stamp to drop results
+    computed before the data changed. The stamp follows the clock, so a database
+    rebuilt from scratch never reuses the stamp of the file it replaced.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    
+    Returns
+    -------
+    version: int
+        The new data version.
+    '''
+    version = cursor.execute("PRAGMA user_version").fetchone()[0]
+    version = max(version + 1, int(time.time()) & 0x7FFFFFFF)
+    cursor.execute(f"PRAGMA user_version = {version}")
+    return version
+
+
+def begin_load():
+    '''Open the database for a bulk load: apply the LOAD_PRAGMAS and begin one
+    explicit transaction.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    connection: sqlite3.Connection
+        The database connection, in autocommit mode.
+    cursor: sqlite3.Cursor
+        The cursor of the connection, inside the transaction.
+    '''
+    connection = sqlite3.connect(DBNAME, isolation_level = None)
+    cursor = connection.cursor()
+    for pragma in LOAD_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.execute("BEGIN")
+    return connection, cursor
+
+
+def write_batch(cursor, batch, location_index = None):
+    '''Write a batch of records of one type with executemany.
+        
+    Parameters
+    ----------
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    batch: RecordBatch
+        The records to be written.
+    location_index: LocationIndex
+        The index of the loaded locations, needed for quest batches.
+    
+    Returns
+    -------
+    None
+    '''
+    if batch.record_type is NPC:
+        image_ids = store_images(cursor, batch.columns["img_name"])
+        insert = "INSERT OR IGNORE INTO NPCs ('Name', 'Url', 'Info', 'Gender', 'ImageId') VALUES(?, ?, ?, ?, ?)"
+        image_column = [image_ids[img_name] for img_name in batch.columns["img_name"]]
+        cursor.executemany(insert, batch.rows("name", "url", "info", "gender", image_column))
+
+    elif batch.record_type is Location:
+        insert = "INSERT OR IGNORE INTO Locations ('Name', 'Url', 'Info', 'PreviousLocation', 'NextLocation') VALUES(?, ?, ?, ?, ?)"
+        cursor.executemany(insert, batch.rows("name", "url", "info", "previous_location", "next_location"))
+
+    elif batch.record_type is Quest:
+        insert = "INSERT OR IGNORE INTO Quests ('Name', 'Url', 'Giver', 'Location', 'Reward', 'Category') VALUES(?, ?, ?, ?, ?, ?)"
+        location_column = [location_index.resolve(location) for location in batch.columns["location"]]
+        cursor.executemany(insert, batch.rows("name", "url", "giver", location_column, "reward", "category"))
+
+    elif batch.record_type is Fish:
+        image_ids = store_images(cursor, batch.columns["img_name"])
+        insert = "INSERT OR IGNORE INTO Fishes ('Name', 'Url', 'Location', 'Price', 'ImageId') VALUES(?, ?, ?, ?, ?)"
+        image_column = [image_ids[img_name] for img_name in batch.columns["img_name"]]
+        cursor.executemany(insert, batch.rows("name", "url", "location", "price", image_column))
+
+
+def load_location_index(cursor):
+    '''Build the LocationIndex of the locations loaded so far.'''
+    return LocationIndex(cursor.execute("SELECT Id, Name FROM Locations").fetchall())
+
+
+def finish_load(connection, cursor, location_index):
+    '''Link the fishes to their locations, build the search tables and indexes,
+    commit the load transaction and close the connection.
+        
+    Parameters
+    ----------
+    connection: sqlite3.Connection
+        The database connection of the load.
+    cursor: sqlite3.Cursor
+        The cursor of the connection, inside the transaction.
+    location_index: LocationIndex
+        The index of the loaded locations.
+    
+    Returns
+    -------
+    None
+    '''
+    fish_rows = cursor.execute("SELECT Id, Location FROM Fishes").fetchall()
+    insert = "INSERT OR IGNORE INTO FishingLocation ('Fish', 'Location') VALUES(?, ?)"
+    cursor.executemany(insert, fishing_links(fish_rows, location_index))
+
+    rebuild_search(cursor)
+    rebuild_stats(cursor)
+    create_indexes(cursor)
+    bump_data_version(cursor)
+    cursor.execute("COMMIT")
+    cursor.execute("PRAGMA synchronous = NORMAL")
+    cursor.execute("PRAGMA optimize")
+    connection.close()
+
+
+def load_data(NPC_list, location_list, quest_list, fish_list):
+    '''Bulk load parsed records into the database.
+    Every table is written with executemany inside one explicit transaction,
+    with the LOAD_PRAGMAS applied, and the indexes are created after the load.
+        
+    Parameters
+    ----------
+    NPC_list: RecordBatch or list
+        The NPC records.
+    location_list: RecordBatch or list
+        The location records.
+    quest_list: RecordBatch or list
+        The quest records.
+    fish_list: RecordBatch or list
+        The fish records.
+    
+    Returns
+    -------
+    None
+    '''
+    connection, cursor = begin_load()
+    try:
+        write_batch(cursor, as_batch(NPC, NPC_list))
+        write_batch(cursor, as_batch(Location, location_list))
+        location_index = load_location_index(cursor)
+        write_batch(cursor, as_batch(Quest, quest_list), location_index)
+        write_batch(cursor, as_batch(Fish, fish_list))
+        finish_load(connection, cursor, location_index)
+    except:
+        cursor.execute("ROLLBACK")
+        connection.close()
+        raise
+
+
+def stream_data(refresh = False, batch_size = STREAM_BATCH_SIZE, queue_size = STREAM_QUEUE_SIZE):
+    '''Scrape and load the database as one pipeline.
+    A producer thread runs the fetch and parse stages of stream_records and
+    hands the rows over through a bounded queue, so it never runs more than
+    queue_size rows ahead. The main thread groups them into batches of up to
+    batch_size rows of one type and writes each batch as soon as it is full,
+    so parsing, fetching and writing overlap. The load is one transaction,
+    like load_data.
         
     Parameters
     ----------
-    None
+    refresh: bool
+        Whether to revalidate the cached pages before parsing them.
+    batch_size: int
+        The most rows written by one executemany.
+    queue_size: int
+        The most rows waiting between the parser and the writer.
     
     Returns
     -------
-    fish_list: list
-        A list of fish instances.
+    None
     '''
-    soup = cache_or_fetch(fish_url)
-    fish_list = []
-    p = Path("img_cache")
-    p.mkdir(parents = True, exist_ok = True)
-    
-    rows = soup.find("table", class_ = "wiki_table").find("tbody").find_all("tr")
-
-    for row in rows:
-        columns = row.find_all("td")
-
-        img_url = base_url + columns[0].find("img")["src"]
-        img_name = img_url.split('/')[-1]
-        if not (p / img_name).exists():
-            response = requests.get(img_url)
-            (p / img_name).open("wb").write(response.content)
-        
-        name = columns[0].find_all("a")[-1].text.strip()
-        url = base_url + columns[0].find("a")["href"]
-        price = columns[1].find_all("p")[-1].text.strip()
-        price = int(price.strip("G").replace(",", ""))
-        location = columns[2].text.strip().replace("\n", ", ").replace(u'\xa0', u' ')
-        
-        fish_list.append(Fish(url, name, location, img_name, price))
-
-    #for f in fish_list:
-    #    print(f)
-    return fish_list
-
-
-def convert_to_binary(filename):
-    '''Convert jpg image to binary in order to store in database.
+    rows = queue.Queue(maxsize = queue_size)
+    stop = threading.Event()
+
+    def hand_over(item):
+        while not stop.is_set():
+            try:
+                rows.put(item, timeout = 0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def produce():
+        try:
+            for record in stream_records(refresh):
+                if not hand_over(record):
+                    return
+            hand_over(None)
+        except BaseException as error:
+            hand_over(error)
+
+    producer = threading.Thread(target = produce, daemon = True)
+    producer.start()
+    connection, cursor = begin_load()
+    try:
+        batch = None
+        location_index = None
+        while True:
+            record = rows.get()
+            if isinstance(record, BaseException):
+                raise record
+            if batch is not None and (record is None or record[0] is not batch.record_type or len(batch) >= batch_size):
+                if batch.record_type is Quest and location_index is None:
+                    location_index = load_location_index(cursor)
+                write_batch(cursor, batch, location_index)
+                batch = None
+            if record is None:
+                break
+            if batch is None:
+                batch = RecordBatch(record[0])
+            batch.add(*record[1])
+
+        if location_index is None:
+            location_index = load_location_index(cursor)
+        finish_load(connection, cursor, location_index)
+    except:
+        stop.set()
+        cursor.execute("ROLLBACK")
+        connection.close()
+        raise
+    finally:
+        producer.join()
+
+
+def sync_rows(cursor, table, columns, rows):
+    '''Bring a table in line with freshly scraped rows, using Url as the key.
+    Rows that are new get inserted, rows that differ get updated and rows
+    whose url disappeared upstream get deleted. Unchanged rows are not touched.
+    A row whose url disappeared while a new url has the same name was moved
+    upstream: its Url is rewritten in place, so its Id is kept.
         
     Parameters
     ----------
-    filename: str
-        The path of the image file to be converted.
+    cursor: sqlite3.Cursor
+        The cursor of the database connection.
+    table: str
+        The name of the table.
+    columns: list
+        The column names apart from Url, including Name.
+    rows: dict
+        Url to the tuple of column values.
     
     Returns
     -------
-    blob_data: str
-        The binary string of the image.
+    counts: dict
+        The number of inserted, updated and deleted rows.
     '''
-    with open(filename, 'rb') as file:
-        blob_data = file.read()
-    return blob_data
-
-
-def create_tables():
-    '''Create all database tables.
+    existing = {}
+    for row in cursor.execute(f"SELECT Url, {', '.join(columns)} FROM {table}"):
+        existing[row[0]] = tuple(row[1:])
+    counts = {"inserted": 0, "updated": 0, "deleted": 0}
+
+    name = columns.index("Name")
+    vanished = {existing[url][name].lower(): url for url in existing.keys() - rows.keys()}
+    moved = {}
+    for url, values in rows.items():
+        if url not in existing and values[name].lower() in vanished:
+            moved[url] = vanished.pop(values[name].lower())
+
+    delete = f"DELETE FROM {table} WHERE Url = ?"
+    for url in vanished.values():
+        cursor.execute(delete, (url, ))
+        counts["deleted"] += cursor.rowcount
+
+    insert = f"INSERT INTO {table} (Url, {', '.join(columns)}) VALUES(?, {', '.join('?' for c in columns)})"
+    update = f"UPDATE {table} SET Url = ?, {', '.join(c + ' = ?' for c in columns)} WHERE Url = ?"
+    for url, values in rows.items():
+        if url in moved:
+            cursor.execute(update, (url, ) + values + (moved[url], ))
+            counts["updated"] += cursor.rowcount
+        elif url not in existing:
+            cursor.execute(insert, (url, ) + values)
+            counts["inserted"] += cursor.rowcount
+        elif existing[url] != values:
+            cursor.execute(update, (url, ) + values + (url, ))
+            counts["updated"] += cursor.rowcount
+    return counts
+
+
+def update_data():
+    '''Incrementally refresh an existing database.
+    The index pages are revalidated first, then the detail pages they list, so
+    pages of entities that were removed upstream are not requested. Only the
+    entities whose pages changed are parsed again, and only their new, changed
+    or removed rows are written.
         
     Parameters
     ----------
@@ -405,119 +2424,171 @@ def create_tables():
     
     Returns
     -------
-    None
+    report: dict
+        Table name to the number of inserted, updated and deleted rows.
+        Empty if nothing changed upstream.
     '''
+    cache = get_page_cache()
     connection = sqlite3.connect(DBNAME)
     cursor = connection.cursor()
-
-    create_NPC = '''CREATE TABLE IF NOT EXISTS NPCs (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
-    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Info TEXT, Gender TEXT, Image BLOB)'''
-    cursor.execute(create_NPC)
-
-    create_location = '''CREATE TABLE IF NOT EXISTS Locations (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
-    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE COLLATE NOCASE, Info TEXT, PreviousLocation TEXT, NextLocation TEXT)'''
-    cursor.execute(create_location)
-
-    create_quest = '''CREATE TABLE IF NOT EXISTS Quests (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
-    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Giver TEXT COLLATE NOCASE, Location INTEGER, Reward TEXT COLLATE NOCASE, Category TEXT,
-    FOREIGN KEY(Location) REFERENCES Locations(Id))'''
-    cursor.execute(create_quest)
-
-    create_fish = '''CREATE TABLE IF NOT EXISTS Fishes (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, 
-    Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Location TEXT COLLATE NOCASE, Price INTEGER, Image BLOB)'''
-    cursor.execute(create_fish)
-
-    create_fishing_location = '''CREATE TABLE IF NOT EXISTS FishingLocation (Fish INTEGER, Location INTEGER,
-    FOREIGN KEY(Fish) REFERENCES Fishes(Id), FOREIGN KEY(Location) REFERENCES Locations(Id))'''
-    cursor.execute(create_fishing_location)
-
+    report = {}
+
+    search_table = list(SEARCH_TABLES.values())[0][0]
+    new_search = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (search_table, )).fetchone() is None
+    new_stats = cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (list(STATS_TABLES)[0], )).fetchone() is None
+    create_tables()
+    for table in ["NPCs", "Fishes"]:
+        if "ImageId" not in [row[1] for row in cursor.execute(f"PRAGMA table_info({table})")]:
+            cursor.execute(f"ALTER TABLE {table} ADD COLUMN ImageId INTEGER REFERENCES Images(Id)")
+            for row_id, blob_data in cursor.execute(f"SELECT Id, Image FROM {table} WHERE Image IS NOT NULL").fetchall():
+                cursor.execute(f"UPDATE {table} SET ImageId = ? WHERE Id = ?", (store_image(cursor, blob_data), row_id))
+            cursor.execute(f"UPDATE {table} SET Image = NULL")
+    backfill_image_metadata(cursor)
+    if new_search:
+        rebuild_search(cursor)
+    if new_stats:
+        rebuild_stats(cursor)
+    create_indexes(cursor)
+
+    index_urls = [NPC_url, location_url, main_quest_url, side_quest_url, fish_url]
+    prefetch_pages(index_urls, refresh = True)
+    NPC_urls = [url for name, url, img_url in parse_page(NPC_url, "NPC index")]
+    location_urls = [url for name, url in parse_page(location_url, "Location index")]
+    prefetch_pages(NPC_urls + location_urls, refresh = True)
+
+    NPCs_changed = any(url in cache.changed for url in [NPC_url] + NPC_urls)
+    locations_changed = any(url in cache.changed for url in [location_url] + location_urls)
+    quests_changed = locations_changed or main_quest_url in cache.changed or side_quest_url in cache.changed
+    fishes_changed = fish_url in cache.changed
+
+    if NPCs_changed:
+        NPC_list = get_NPCs(refresh = True)
+        image_ids = store_images(cursor, NPC_list.columns["img_name"])
+        rows = {}
+        for NPC in NPC_list:
+            rows[NPC.url] = (NPC.name, NPC.info, NPC.gender, image_ids[NPC.img_name])
+        report["NPCs"] = sync_rows(cursor, "NPCs", ["Name", "Info", "Gender", "ImageId"], rows)
+
+    if locations_changed:
+        rows = {}
+        for location in get_locations(refresh = True):
+            rows[location.url] = (location.name, location.info, location.previous_location, location.next_location)
+        report["Locations"] = sync_rows(cursor, "Locations", ["Name", "Info", "PreviousLocation", "NextLocation"], rows)
+
+    location_index = LocationIndex(cursor.execute("SELECT Id, Name FROM Locations").fetchall())
+    if quests_changed:
+        rows = {}
+        for quest in get_main_quests(refresh = True) + get_side_quests(refresh = True):
+            rows[quest.url] = (quest.name, quest.giver, location_index.resolve(quest.location), quest.reward, quest.category)
+        report["Quests"] = sync_rows(cursor, "Quests", ["Name", "Giver", "Location", "Reward", "Category"], rows)
+
+    if fishes_changed:
+        fish_list = get_fishes(refresh = True)
+        image_ids = store_images(cursor, fish_list.columns["img_name"])
+        rows = {}
+        for fish in fish_list:
+            rows[fish.url] = (fish.name, fish.location, fish.price, image_ids[fish.img_name])
+        report["Fishes"] = sync_rows(cursor, "Fishes", ["Name", "Location", "Price", "ImageId"], rows)
+
+    if fishes_changed or locations_changed:
+        fish_rows = cursor.execute("SELECT Id, Location FROM Fishes").fetchall()
+        links = set(fishing_links(fish_rows, location_index))
+        existing = set(cursor.execute("SELECT Fish, Location FROM FishingLocation").fetchall())
+        cursor.executemany("INSERT INTO FishingLocation ('Fish', 'Location') VALUES(?, ?)", links - existing)
+        cursor.executemany("DELETE FROM FishingLocation WHERE Fish = ? AND Location = ?", existing - links)
+        report["FishingLocation"] = {"inserted": len(links - existing), "updated": 0, "deleted": len(existing - links)}
+
+    if NPCs_changed or fishes_changed:
+        cursor.execute("DELETE FROM Images WHERE Id NOT IN (SELECT ImageId FROM NPCs WHERE ImageId IS NOT NULL "
+            "UNION SELECT ImageId FROM Fishes WHERE ImageId IS NOT NULL)")
+        cursor.execute("DELETE FROM Thumbnails WHERE Image NOT IN (SELECT Id FROM Images)")
+
+    if report:
+        bump_data_version(cursor)
+    get_page_cache().flush()
     connection.commit()
     connection.close()
+    cache.changed.clear()
+    return report
 
 
-def insert_data():
-    '''Insert all database data.
+class HtmlReport:
+    '''Collects the figures and images of a session and writes them to one
+    HTML file instead of opening a browser tab per figure.
+    The plotly.js bundle is embedded once and shared by all figures. Images are
+    written next to the report, once per distinct image, and referenced by
+    img tags. With export set to "png" or "svg" (needs kaleido), every figure
+    is also saved as a static file.
+    '''
+    def __init__(self, filename, export = None):
+        if export is not None and not STATIC_EXPORT:
+            raise RuntimeError("PNG/SVG export needs the kaleido package")
+        self.filename = Path(filename)
+        self.folder = self.filename.with_name(self.filename.stem + "_files")
+        self.export = export
+        self.sections = []
+        self.figures = 0
+        self.images = {}
+
+    def add_figure(self, fig):
+        '''Add a plotly figure. Only the first figure carries the plotly.js bundle.'''
+        self.sections.append(fig.to_html(full_html = False, include_plotlyjs = self.figures == 0))
+        self.figures += 1
+        if self.export is not None:
+            self.folder.mkdir(parents = True, exist_ok = True)
+            fig.write_image(str(self.folder / f"figure_{self.figures}.{self.export}"))
+
+    def add_images(self, binary_strings, names = None):
+        '''Add a gallery of images. Identical images share one file.'''
+        self.folder.mkdir(parents = True, exist_ok = True)
+        names = names or [""] * len(binary_strings)
+        tags = []
+        for img, name in zip(binary_strings, names):
+            digest = hashlib.sha256(img).hexdigest()[:16]
+            if digest not in self.images:
+                path = self.folder / (digest + image_type(img)[1])
+                path.write_bytes(img)
+                self.images[digest] = f"{self.folder.name}/{path.name}"
+            tags.append(f'<figure><img src="{self.images[digest]}" loading="lazy"><figcaption>{html.escape(name)}</figcaption></figure>')
+        self.sections.append('<div class="gallery">' + "".join(tags) + "</div>")
+
+    def write(self):
+        '''Write the report with one file write and return its path.'''
+        page = ('<!DOCTYPE html><html><head><meta charset="utf-8"><title>NieR: Automata query report</title>'
+                "<style>.gallery{display:flex;flex-wrap:wrap;gap:8px}.gallery img{max-height:240px}</style>"
+                "</head><body>" + "<hr>".join(self.sections) + "</body></html>")
+        self.filename.write_text(page, encoding = "utf-8")
+        return self.filename
+
+
+html_report = None
+
+def start_report(filename, export = None):
+    '''Send all following figures and images to an HtmlReport instead of the browser.
         
     Parameters
     ----------
-    None
+    filename: str
+        The path of the HTML report.
+    export: str
+        "png" or "svg" to also save every figure as a static file, None otherwise.
     
     Returns
     -------
-    None
+    html_report: HtmlReport
+        The report, call write to save it.
     '''
-    NPC_list = get_NPCs()
-    location_list = get_locations()
-    quest_list = get_main_quests() + get_side_quests()
-    fish_list = get_fishes()
-    connection = sqlite3.connect(DBNAME)
-    cursor = connection.cursor()
-    p = Path("img_cache")
-    location_id_dict = {}
-    fish_id_dict = {}
-
-    insert = "INSERT OR IGNORE INTO NPCs ('Name', 'Url', 'Info', 'Gender', 'Image') VALUES(?, ?, ?, ?, ?)"
-    for NPC in NPC_list:
-        url = NPC.url
-        name = NPC.name
-        info = NPC.info
-        gender = NPC.gender
-        image = convert_to_binary((p / NPC.img_name))
-        data_tuple = (name, url, info, gender, image)
-        cursor.execute(insert, data_tuple)
-
-    insert = "INSERT OR IGNORE INTO Locations ('Name', 'Url', 'Info', 'PreviousLocation', 'NextLocation') VALUES(?, ?, ?, ?, ?)"
-    for location in location_list:
-        url = location.url
-        name = location.name
-        info = location.info
-        previous_location = location.previous_location
-        next_location = location.next_location
-        data_tuple = (name, url, info, previous_location, next_location)
-        cursor.execute(insert, data_tuple)
-
-    query = "SELECT Id, Name FROM Locations"
-    result = cursor.execute(query).fetchall()
-    for r in result:
-        location_id_dict[r[1]] = r[0]
-    
-    insert = "INSERT OR IGNORE INTO Quests ('Name', 'Url', 'Giver', 'Location', 'Reward', 'Category') VALUES(?, ?, ?, ?, ?, ?)"
-    for quest in quest_list:
-        name = quest.name
-        url = quest.url
-        giver = quest.giver
-        reward = quest.reward
-        category = quest.category
-        for key, value in location_id_dict.items():
-            if quest.location == key:
-                location = value
-        data_tuple = (name, url, giver, location, reward, category)
-        cursor.execute(insert, data_tuple)
-
-    insert = "INSERT OR IGNORE INTO Fishes ('Name', 'Url', 'Location', 'Price', 'Image') VALUES(?, ?, ?, ?, ?)"
-    for fish in fish_list:
-        name = fish.name
-        url = fish.url
-        price = fish.price
-        location = fish.location
-        image = convert_to_binary((p / fish.img_name))
-        data_tuple = (name, url, location, price, image)
-        cursor.execute(insert, data_tuple)
-
-    query = "SELECT Id, Name FROM Fishes"
-    result = cursor.execute(query).fetchall()
-    for r in result:
-        fish_id_dict[r[1]] = r[0]
+    global html_report
+    html_report = HtmlReport(filename, export)
+    return html_report
 
-    insert = "INSERT OR IGNORE INTO FishingLocation ('Fish', 'Location') VALUES(?, ?)"
-    for fish in fish_list:
-        for location in location_list:
-            if location.name in fish.location:
-                data_tuple = (fish_id_dict[fish.name], location_id_dict[location.name])
-                cursor.execute(insert, data_tuple)
 
-    connection.commit()
-    connection.close()
+def show_figure(fig):
+    '''Add the figure to the active report, or open it in the browser if there is none.'''
+    if html_report is not None:
+        html_report.add_figure(fig)
+    else:
+        fig.show()
 
 
 def make_tables(header_data, cell_data):
@@ -544,7 +2615,7 @@ def make_tables(header_data, cell_data):
             line_color = 'darkslategray',
             fill_color = 'lightcyan',
             align='center'))])
-    fig.show()
+    show_figure(fig)
     
 
 def bar_chart(xvals, yvals):
@@ -565,11 +2636,11 @@ def bar_chart(xvals, yvals):
     bar_data = go.Bar(x = xvals, y = yvals)
     basic_layout = go.Layout()
     fig = go.Figure(data = bar_data, layout = basic_layout)
-    fig.show()
+    show_figure(fig)
 
 
 def show_image(binary_strings):
-    '''Use Plotly to display the chosen images.
+    '''Use Plotly to display the chosen images, or add them to the active report.
         
     Parameters
     ----------
@@ -580,35 +2651,776 @@ def show_image(binary_strings):
     -------
     None
     '''
-    prefix = "data:image/jpg;base64,"
+    if html_report is not None:
+        html_report.add_images(binary_strings)
+        return
     for img in binary_strings:
-        img = prefix + base64.b64encode(img).decode("utf-8")
+        img = f"data:{image_type(img)[0]};base64," + base64.b64encode(img).decode("utf-8")
         fig = go.Figure(go.Image(source = img))
         fig.update_xaxes(showticklabels = False)
         fig.update_yaxes(showticklabels = False)
         fig.show()
 
 
+class QueryCache:
+    '''An LRU cache of query results keyed by (SQL, parameters).
+    Entries expire after ttl seconds, at most max_entries are kept, and all
+    entries are dropped when the data version of the database changes.
+    '''
+    def __init__(self, max_entries = QUERY_CACHE_SIZE, ttl = QUERY_CACHE_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evictions": 0, "invalidations": 0}
+
+    def check_version(self, version):
+        '''Drop every entry if the data version differs from the one the entries were computed at.
+        Returns whether it differed.'''
+        with self.lock:
+            if version == self.version:
+                return False
+            if self.entries:
+                self.stats["invalidations"] += 1
+            self.entries.clear()
+            self.version = version
+            return True
+
+    def get(self, key):
+        '''Return the cached result of the key, or None on a miss.'''
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and self.ttl is not None and entry[0] < time.monotonic() - self.ttl:
+                del self.entries[key]
+                self.stats["expired"] += 1
+                entry = None
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            self.entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return entry[1]
+
+    def put(self, key, result):
+        '''Store a result, evicting the least recently used entries beyond max_entries.'''
+        with self.lock:
+            self.entries[key] = (time.monotonic(), result)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last = False)
+                self.stats["evictions"] += 1
+
+    def clear(self):
+        '''Drop every entry.'''
+        with self.lock:
+            self.entries.clear()
+            self.version = None
+
+    def summary(self):
+        '''Return the hit rate, size and eviction counts of the cache.'''
+        with self.lock:
+            lookups = self.stats["hits"] + self.stats["misses"]
+            return dict(self.stats, entries = len(self.entries),
+                        hit_rate = round(self.stats["hits"] / lookups, 3) if lookups else None)
+
+
+class ConnectionPool:
+    '''A pool of long-lived, read-optimized connections to the database.
+    Connections are opened lazily up to size and handed out one thread at
+    a time, so the pool can be shared by worker threads.
+    If the file is replaced, e.g. deleted and built again by another process,
+    the open connections still point at the old file. The pool notices this on
+    checkout by its device and inode, and opens new connections instead.
+    '''
+    def __init__(self, filename = DBNAME, size = QUERY_POOL_SIZE):
+        self.filename = filename
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.connections = []
+        self.lock = threading.Lock()
+        self.identity = self.file_identity()
+
+    def file_identity(self):
+        '''Return the (device, inode) of the file, or None if it does not exist.'''
+        try:
+            stat = os.stat(self.filename)
+        except FileNotFoundError:
+            return None
+        return (stat.st_dev, stat.st_ino)
+
+    def check_file(self):
+        '''Drop the connections to a file that was replaced. Connections that are
+        borrowed at the time are closed when they are returned.'''
+        identity = self.file_identity()
+        if identity is None or identity == self.identity:
+            return
+        with self.lock:
+            if identity == self.identity:
+                return
+            self.identity = identity
+            self.connections = []
+            while True:
+                try:
+                    self.idle.get_nowait().close()
+                except queue.Empty:
+                    break
+
+    def connect(self):
+        '''Open a new query_only connection with a larger cache, mmap reads and a statement cache.'''
+        connection = sqlite3.connect(self.filename, check_same_thread = False, cached_statements = STATEMENT_CACHE_SIZE)
+        for pragma in QUERY_PRAGMAS:
+            connection.execute(pragma)
+        return connection
+
+    @contextmanager
+    def connection(self):
+        '''Borrow a connection for the duration of a with block.'''
+        self.check_file()
+        try:
+            connection = self.idle.get_nowait()
+        except queue.Empty:
+            with self.lock:
+                connection = None
+                if len(self.connections) < self.size:
+                    connection = self.connect()
+                    self.connections.append(connection)
+            if connection is None:
+                connection = self.idle.get()
+        try:
+            yield connection
+        finally:
+            with self.lock:
+                current = connection in self.connections
+            if current:
+                self.idle.put(connection)
+            else:
+                connection.close()
+
+    def close(self):
+        '''Close every connection of the pool.'''
+        with self.lock:
+            for connection in self.connections:
+                connection.close()
+            self.connections = []
+            self.idle = queue.LifoQueue()
+
+
+query_pool = None
+
+def get_query_pool():
+    '''Return the shared ConnectionPool used by run_queries, opening it on first use.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    query_pool: ConnectionPool
+        The pool of read connections to DBNAME.
+    '''
+    global query_pool
+    if query_pool is None:
+        query_pool = ConnectionPool(DBNAME)
+        atexit.register(query_pool.close)
+    return query_pool
+
+
+query_cache = None
+
+def get_query_cache():
+    '''Return the shared QueryCache used by run_queries, creating it on first use.
+        
+    Parameters
+    ----------
+    None
+    
+    Returns
+    -------
+    query_cache: QueryCache
+        The cache of query results.
+    '''
+    global query_cache
+    if query_cache is None:
+        query_cache = QueryCache()
+    return query_cache
+
+
+def use_database(filename):
+    '''Point loading and querying at another database file.
+    The query pool is closed and the cached results and table checks are dropped.
+        
+    Parameters
+    ----------
+    filename: str
+        The path of the database.
+    
+    Returns
+    -------
+    None
+    '''
+    global DBNAME, query_pool, search_available, stats_available
+    if query_pool is not None:
+        query_pool.close()
+    query_pool = None
+    if query_cache is not None:
+        query_cache.clear()
+    search_available = None
+    stats_available = None
+    DBNAME = filename
+
+
 def run_queries(query, para = None):
     '''Run SQL query specified by the parameter 'query'.
+    The query runs on a pooled connection instead of opening a new one, and
+    results are served from the query cache while the database file and its
+    data version are unchanged.
     
     Parameters
     ----------
     query: string
         The query string for SQL.
+    para: tuple
+        The parameters of the query, if any.
     
     Returns
     -------
     result: list
         The search result as a list of tuples.
     '''
-    connection = sqlite3.connect(DBNAME)
-    cursor = connection.cursor()
-    if para is not None:
-        result = cursor.execute(query, para).fetchall()
+    global search_available, stats_available
+    cache = get_query_cache()
+    pool = get_query_pool()
+    key = (query, tuple(para) if para is not None else None)
+    with pool.connection() as connection:
+        cursor = connection.cursor()
+        if cache.check_version((pool.identity, cursor.execute("PRAGMA user_version").fetchone()[0])):
+            search_available = None
+            stats_available = None
+        result = cache.get(key)
+        if result is None:
+            if para is not None:
+                result = cursor.execute(query, para).fetchall()
+            else:
+                result = cursor.execute(query).fetchall()
+            cache.put(key, result)
+        cursor.close()
+    return list(result)
+
+
+search_available = None
+
+def check_value(filter, value, allow_empty = True):
+    '''Raise ValueError if a filter that takes a value was given none.
+    
+    Parameters
+    ----------
+    filter: str
+        The name of the filter.
+    value: str
+        The value given for the filter.
+    allow_empty: bool
+        Whether a blank value is accepted, as it is from the prompts where it
+        matches everything. The HTTP service rejects it.
+    
+    Returns
+    -------
+    None
+    '''
+    if value is None or (not allow_empty and not value.strip()):
+        raise ValueError(f"filter '{filter}' needs a value")
+
+
+def text_filter(table, column, term):
+    '''Build the condition that matches rows whose column contains the term.
+    Terms of three or more characters use the trigram full text search table
+    of the table, shorter terms (or databases without search tables) use LIKE.
+    
+    Parameters
+    ----------
+    table: str
+        The table to be filtered, a key of SEARCH_TABLES.
+    column: str
+        The column to be searched.
+    term: str
+        The text to search for.
+    
+    Returns
+    -------
+    condition: str
+        The SQL condition.
+    para: tuple
+        The parameters of the condition.
+    '''
+    global search_available
+    if search_available is None:
+        query = "SELECT COUNT(*) FROM sqlite_master WHERE name = ?"
+        search_available = run_queries(query, (SEARCH_TABLES[table][0], ))[0][0] > 0
+    term = term.strip()
+    if search_available and len(term) >= 3:
+        search_table = SEARCH_TABLES[table][0]
+        condition = f"{table}.Id IN (SELECT rowid FROM {search_table} WHERE {search_table}.{column} MATCH ?)"
+        return condition, ('"' + term.replace('"', '""') + '"', )
+    return f"{table}.{column} LIKE ?", ("%" + term + "%", )
+
+
+def query_NPCs(filter = "all", value = None):
+    '''Query NPCs with one filter, as offered by NPC_prompt.
+    
+    Parameters
+    ----------
+    filter: str
+        One of "all", "with main quest", "with side quest" or "name".
+    value: str
+        The name to search for, for the "name" filter.
+    
+    Returns
+    -------
+    result: list
+        (name, info, gender) of every matching NPC.
+    '''
+    query = "SELECT DISTINCT NPCs.Name, NPCs.Info, NPCs.Gender FROM NPCs "
+    if filter == "name":
+        check_value(filter, value)
+    if filter == "all":
+        return run_queries(query)
+    elif filter == "with main quest":
+        query += "JOIN Quests ON Quests.Giver = NPCs.Name WHERE Quests.Category = 'main'"
+        return run_queries(query)
+    elif filter == "with side quest":
+        query += "JOIN Quests ON Quests.Giver = NPCs.Name WHERE Quests.Category = 'side'"
+        return run_queries(query)
+    elif filter == "name":
+        condition, name = text_filter("NPCs", "Name", value)
+        query += "WHERE " + condition
+        return run_queries(query, name)
+    raise ValueError(f"Unknown NPC filter: {filter}")
+
+
+def query_locations(filter = "all", value = None):
+    '''Query locations with one filter, as offered by location_prompt.
+    
+    Parameters
+    ----------
+    filter: str
+        One of "all", "quest" (exact quest name), "fish" (exact fish name) or "name".
+    value: str
+        The value of the filter.
+    
+    Returns
+    -------
+    result: list
+        (name, info) of every matching location.
+    '''
+    query = "SELECT DISTINCT Locations.Name, Locations.Info FROM Locations "
+    if filter in ["quest", "fish", "name"]:
+        check_value(filter, value)
+    if filter == "all":
+        return run_queries(query)
+    elif filter == "quest":
+        query += "JOIN Quests ON Quests.Location = Locations.Id WHERE Quests.Name = ?"
+        return run_queries(query, (value.strip(), ))
+    elif filter == "fish":
+        query += "JOIN FishingLocation ON Locations.Id = FishingLocation.Location JOIN Fishes ON FishingLocation.Fish = Fishes.Id WHERE Fishes.Name = ?"
+        return run_queries(query, (value.strip(), ))
+    elif filter == "name":
+        condition, name = text_filter("Locations", "Name", value)
+        query += "WHERE " + condition
+        return run_queries(query, name)
+    raise ValueError(f"Unknown location filter: {filter}")
+
+
+def query_quests(filter = "all", value = None):
+    '''Query quests with one filter, as offered by quest_prompt.
+    
+    Parameters
+    ----------
+    filter: str
+        One of "all", "giver" (or "no giver"), "location", "reward" (or "no reward"),
+        "category" (main or side) or "name".
+    value: str
+        The value of the filter.
+    
+    Returns
+    -------
+    result: list
+        (name, giver, location, reward, category) of every matching quest.
+    '''
+    query = "SELECT Quests.Name, Quests.Giver, Locations.Name, Quests.Reward, Quests.Category FROM Quests, Locations WHERE Quests.Location = Locations.Id "
+    if filter in ["giver", "location", "reward", "category", "name"]:
+        check_value(filter, value)
+    if filter == "all":
+        return run_queries(query)
+    elif filter == "giver":
+        if value.strip() == "no giver":
+            query += "AND Quests.Giver IS NULL"
+            return run_queries(query)
+        condition, name = text_filter("Quests", "Giver", value)
+        query += "AND " + condition
+        return run_queries(query, name)
+    elif filter == "location":
+        condition, name = text_filter("Locations", "Name", value)
+        query += "AND " + condition
+        return run_queries(query, name)
+    elif filter == "reward":
+        if value.strip() == "no reward":
+            query += "AND Quests.Reward IS NULL"
+            return run_queries(query)
+        condition, name = text_filter("Quests", "Reward", value)
+        query += "AND " + condition
+        return run_queries(query, name)
+    elif filter == "category":
+        query += "AND Quests.Category = ?"
+        return run_queries(query, (value.strip(), ))
+    elif filter == "name":
+        condition, name = text_filter("Quests", "Name", value)
+        query += "AND " + condition
+        return run_queries(query, name)
+    raise ValueError(f"Unknown quest filter: {filter}")
+
+
+def query_fishes(filter = "all", value = None):
+    '''Query fishes with one filter, as offered by fish_prompt.
+    
+    Parameters
+    ----------
+    filter: str
+        One of "all", "location", "price" (the lowest price) or "name".
+    value: str
+        The value of the filter.
+    
+    Returns
+    -------
+    result: list
+        (name, location, price) of every matching fish.
+    '''
+    query = "SELECT Fishes.Name, Fishes.Location, Fishes.Price FROM Fishes "
+    if filter in ["location", "price", "name"]:
+        check_value(filter, value)
+    if filter == "all":
+        return run_queries(query)
+    elif filter == "location":
+        condition, name = text_filter("Fishes", "Location", value)
+        query += "WHERE " + condition
+        return run_queries(query, name)
+    elif filter == "price":
+        query += "WHERE Fishes.Price >= ?"
+        return run_queries(query, (int(float(value)), ))
+    elif filter == "name":
+        condition, name = text_filter("Fishes", "Name", value)
+        query += "WHERE " + condition
+        return run_queries(query, name)
+    raise ValueError(f"Unknown fish filter: {filter}")
+
+
+# Stats option of stats_prompt: (description, aggregate query, stats table).
+# The aggregate query is only used for databases built before the stats tables existed.
+STATS_QUERIES = {
+    "1": ("Location -  Number of Quest",
+          "SELECT Locations.Name, COUNT(*) FROM Locations JOIN Quests ON Quests.Location = Locations.Id GROUP BY Locations.Name ORDER BY COUNT(*) DESC",
+          "StatsLocationQuests"),
+    "2": ("Location - Kinds of Fishes",
+          "SELECT Locations.Name, COUNT(*) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "
+          "GROUP BY Locations.Name ORDER BY COUNT(*) DESC", "StatsLocationFishes"),
+    "3": ("Location - Average Fish Price",
+          "SELECT Locations.Name, AVG(Fishes.Price) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "
+          "JOIN Fishes ON Fishes.Id = FishingLocation.Fish GROUP BY Locations.Name ORDER BY AVG(Fishes.Price) DESC", "StatsLocationPrice"),
+    "4": ("Fish - Number of Fishing Location",
+          "SELECT Fishes.Name, COUNT(*) FROM Fishes JOIN FishingLocation ON FishingLocation.Fish = Fishes.Id "
+          "JOIN Locations ON Locations.Id = FishingLocation.Location GROUP BY Fishes.Name ORDER BY COUNT(*) DESC", "StatsFishLocations"),
+    "5": ("NPC - Number of Quest",
+          "SELECT NPCs.Name, COUNT(*) FROM NPCs JOIN Quests ON Quests.Giver = NPCs.Name GROUP BY NPCs.Name ORDER BY COUNT(*) DESC",
+          "StatsNPCQuests"),
+}
+
+
+stats_available = None
+
+def query_stats(option):
+    '''Run one of the statistics of stats_prompt.
+    The result is read from its stats table, which is kept up to date by
+    triggers, so only the result rows are read. Databases without stats
+    tables fall back to the aggregate query.
+    
+    Parameters
+    ----------
+    option: str
+        A key of STATS_QUERIES, "1" to "5".
+    
+    Returns
+    -------
+    result: list
+        (name, value) pairs, largest value first.
+    '''
+    global stats_available
+    if option not in STATS_QUERIES:
+        raise ValueError(f"Unknown statistic: {option}")
+    description, query, stats_table = STATS_QUERIES[option]
+    if stats_available is None:
+        stats_available = run_queries("SELECT COUNT(*) FROM sqlite_master WHERE name = ?", (stats_table, ))[0][0] > 0
+    if stats_available:
+        return run_queries(f"SELECT Name, Value FROM {stats_table} ORDER BY Value DESC")
+    return run_queries(query)
+
+
+def query_image_ids(entity, value):
+    '''Find the image ids of the NPCs or fishes whose name contains the value.
+    
+    Parameters
+    ----------
+    entity: str
+        "npc" or "fish".
+    value: str
+        The name to search for.
+    
+    Returns
+    -------
+    result: list
+        (name, image id) of every matching NPC or fish.
+    '''
+    tables = {"npc": "NPCs", "fish": "Fishes"}
+    if entity not in tables:
+        raise ValueError(f"Unknown image entity: {entity}")
+    table = tables[entity]
+    check_value("name", value)
+    condition, name = text_filter(table, "Name", value)
+    return run_queries(f"SELECT {table}.Name, {table}.ImageId FROM {table} WHERE " + condition, name)
+
+
+# Filters that take no value.
+FLAG_FILTERS = {"with main quest", "with side quest"}
+
+# Entity: (query function, result columns).
+QUERIES = {
+    "npc": (query_NPCs, ["Name", "Info", "Gender"]),
+    "location": (query_locations, ["Name", "Info"]),
+    "quest": (query_quests, ["Name", "Giver", "Location", "Reward", "Category"]),
+    "fish": (query_fishes, ["Name", "Location", "Price"]),
+    "stats": (query_stats, ["Name", "Value"]),
+}
+
+
+def query(entity, filter = "all", value = None):
+    '''Run a query without any prompt. This is the Python API behind the query
+    commands, and runs the same SQL as the prompts.
+    
+    Parameters
+    ----------
+    entity: str
+        A key of QUERIES.
+    filter: str
+        The filter of the entity, or the option for stats.
+    value: str
+        The value of the filter, if it takes one.
+    
+    Returns
+    -------
+    rows: list
+        One dict per result row, keyed by the columns of the entity.
+    '''
+    if entity not in QUERIES:
+        raise ValueError(f"Unknown entity: {entity}")
+    function, columns = QUERIES[entity]
+    result = function(filter) if entity == "stats" else function(filter, value)
+    return [dict(zip(columns, row)) for row in result]
+
+
+def write_rows(rows, columns, format = "json", file = None):
+    '''Write query rows as JSON, JSON lines or CSV.
+    
+    Parameters
+    ----------
+    rows: list
+        The result rows as dicts.
+    columns: list
+        The columns, in output order.
+    format: str
+        "json", "jsonl" or "csv".
+    file: file
+        The file to write to, stdout by default.
+    
+    Returns
+    -------
+    None
+    '''
+    file = file or sys.stdout
+    if format == "json":
+        json.dump(rows, file, indent = 2, ensure_ascii = False)
+        file.write("\n")
+    elif format == "jsonl":
+        for row in rows:
+            file.write(json.dumps(row, ensure_ascii = False) + "\n")
+    elif format == "csv":
+        writer = csv.DictWriter(file, fieldnames = columns)
+        writer.writeheader()
+        writer.writerows(rows)
     else:
-        result = cursor.execute(query).fetchall()
-    return result
+        raise ValueError(f"Unknown format: {format}")
+
+
+def run_batch(specs):
+    '''Run many queries in one process.
+    
+    Parameters
+    ----------
+    specs: iterable
+        Dicts with an "entity" and optionally a "filter" and a "value".
+    
+    Returns
+    -------
+    results: generator
+        Per spec, the spec with its result rows under "rows", or its "error".
+    '''
+    for spec in specs:
+        try:
+            rows = query(spec["entity"], spec.get("filter", "all"), spec.get("value"))
+            yield dict(spec, rows = rows)
+        except (KeyError, ValueError, TypeError) as error:
+            yield dict(spec, error = str(error))
+
+
+def stream_image(image_id, write, size = None, chunk_size = IMAGE_CHUNK_SIZE, start = None):
+    '''Copy an image from the database to write in chunks, without
+    reading it into memory as a whole. The lookup and the copy run in one read
+    transaction on one connection, so the bytes match the length found.
+    
+    Parameters
+    ----------
+    image_id: int
+        The Id of the image.
+    write: function
+        Called with every chunk of bytes.
+    size: int
+        Copy the smallest thumbnail of at least this size where there is one,
+        None for the original.
+    chunk_size: int
+        The size of the chunks.
+    start: function
+        Called with the length and MIME type of the image before the first chunk.
+    
+    Returns
+    -------
+    size: int
+        The number of bytes written, or None if there is no such image.
+    '''
+    with get_query_pool().connection() as connection:
+        connection.execute("BEGIN")
+        try:
+            image = find_image(connection, image_id, size)
+            if image is None:
+                return None
+            table, rowid, length, mime = image
+            if start is not None:
+                start(length, mime)
+            if not hasattr(connection, "blobopen"):
+                write(connection.execute(f"SELECT Data FROM {table} WHERE Id = ?", (rowid, )).fetchone()[0])
+                return length
+            with connection.blobopen(table, "Data", rowid, readonly = True) as blob:
+                while True:
+                    chunk = blob.read(chunk_size)
+                    if not chunk:
+                        break
+                    write(chunk)
+        finally:
+            connection.commit()
+    return length
+
+
+class QueryHandler(BaseHTTPRequestHandler):
+    '''Serve the queries of the prompts as JSON over HTTP.
+    
+    GET /npc, /location, /quest and /fish take at most one filter of their
+    prompt as a query parameter (spaces as underscores, e.g. /npc?with_main_quest
+    or /quest?giver=Pascal). GET /stats/N runs statistic N. GET /images/npc?name=X
+    and /images/fish?name=X list the matching images, GET /image/ID
+    streams the bytes of an image (its IMAGE_DEFAULT_SIZE thumbnail unless
+    ?size=N asks for another size, 0 for the original) and GET /metrics
+    reports the query cache.
+    '''
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        parts = [part for part in url.path.split("/") if part]
+        params = {key: values[-1] for key, values in parse_qs(url.query, keep_blank_values = True).items()}
+        try:
+            if len(parts) == 1 and parts[0] in QUERIES and parts[0] != "stats":
+                if len(params) > 1:
+                    raise ValueError(f"give at most one filter, got {len(params)}: {', '.join(params)}")
+                filter, value = "all", None
+                for key, given in params.items():
+                    filter, value = key.replace("_", " "), given
+                    if filter not in FLAG_FILTERS:
+                        check_value(filter, value, allow_empty = False)
+                self.send_json(query(parts[0], filter, value))
+            elif len(parts) == 2 and parts[0] == "stats":
+                self.send_json(query("stats", parts[1]))
+            elif len(parts) == 2 and parts[0] == "images":
+                check_value("name", params.get("name"), allow_empty = False)
+                result = query_image_ids(parts[1], params["name"])
+                self.send_json([{"Name": name, "ImageId": image_id, "Url": f"/image/{image_id}"}
+                                for name, image_id in result if image_id is not None])
+            elif len(parts) == 2 and parts[0] == "image" and parts[1].isdigit():
+                self.send_image(int(parts[1]), int(params.get("size", IMAGE_DEFAULT_SIZE)))
+            elif parts == ["metrics"]:
+                self.send_json({"query_cache": get_query_cache().summary()})
+            else:
+                self.send_json({"error": f"Not found: {url.path}"}, 404)
+        except ValueError as error:
+            self.send_json({"error": str(error)}, 400)
+
+    def send_json(self, data, status = 200):
+        '''Send data as a JSON response.'''
+        body = json.dumps(data, ensure_ascii = False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_image(self, image_id, size = None):
+        '''Stream an image or one of its thumbnails from the database in chunks.'''
+        def start(length, mime):
+            self.send_response(200)
+            self.send_header("Content-Type", mime or "application/octet-stream")
+            self.send_header("Content-Length", str(length))
+            self.send_header("Cache-Control", "max-age=86400")
+            self.end_headers()
+
+        if stream_image(image_id, self.wfile.write, size, start = start) is None:
+            self.send_json({"error": f"No image {image_id}"}, 404)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class QueryServer(ThreadingHTTPServer):
+    '''A threading HTTP server with a deep listen backlog, so bursts of
+    hundreds of concurrent clients queue instead of being refused. Request
+    threads share the read connections of the query pool.
+    '''
+    daemon_threads = True
+    request_queue_size = SERVER_BACKLOG
+
+
+def make_server(host = "127.0.0.1", port = 8000):
+    '''Create the query server for DBNAME without starting it.
+    
+    Parameters
+    ----------
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on, 0 for any free port.
+    
+    Returns
+    -------
+    server: QueryServer
+        The server, call serve_forever to start it.
+    '''
+    get_query_pool()
+    return QueryServer((host, port), QueryHandler)
 
 
 def NPC_prompt():
@@ -624,26 +3436,13 @@ def NPC_prompt():
     '''
     while True:
         response = input("Select your filter on NPCs (all, with main quest, with side quest, name) or go back: ").lower().strip()
-        query = "SELECT DISTINCT NPCs.Name, NPCs.Info, NPCs.Gender FROM NPCs "
-
-        if response == "all":
-            result = run_queries(query)
-            return result
-
-        elif response == "with main quest":
-            query += "JOIN Quests ON Quests.Giver = NPCs.Name WHERE Quests.Category = 'main'"
-            result = run_queries(query)
-            return result
 
-        elif response == "with side quest":
-            query += "JOIN Quests ON Quests.Giver = NPCs.Name WHERE Quests.Category = 'side'"
-            result = run_queries(query)
+        if response in ["all", "with main quest", "with side quest"]:
+            result = query_NPCs(response)
             return result
 
         elif response == "name":
-            name = ("%" + input("Please enter the name of the NPC: ").strip() + "%", )
-            query += "WHERE NPCs.Name LIKE ?"
-            result = run_queries(query, name)
+            result = query_NPCs("name", input("Please enter the name of the NPC: "))
             return result
 
         elif response == "back":
@@ -667,28 +3466,21 @@ def location_prompt():
     '''
     while True:
         response = input("Select your filter on locations (all, quest, fish, name) or go back: ").lower().strip()
-        query = "SELECT DISTINCT Locations.Name, Locations.Info FROM Locations "
 
         if response == "all":
-            result = run_queries(query)
+            result = query_locations("all")
             return result
 
         elif response == "quest":
-            name = (input("Please enter the quest whose location you want to search (please enter the exact name for uniqueness): ").strip(), )
-            query += "JOIN Quests ON Quests.Location = Locations.Id WHERE Quests.Name = ?"
-            result = run_queries(query, name)
+            result = query_locations("quest", input("Please enter the quest whose location you want to search (please enter the exact name for uniqueness): "))
             return result
 
         elif response == "fish":
-            name = (input("Please enter the fish whose location you want to search (please enter the exact name for uniqueness): ").strip(), )
-            query += "JOIN FishingLocation ON Locations.Id = FishingLocation.Location JOIN Fishes ON FishingLocation.Fish = Fishes.Id WHERE Fishes.Name = ?"
-            result = run_queries(query, name)
+            result = query_locations("fish", input("Please enter the fish whose location you want to search (please enter the exact name for uniqueness): "))
             return result
 
         elif response == "name":
-            name = ("%" + input("Please enter the name of the location: ").strip() + "%", )
-            query += "WHERE Locations.Name LIKE ?"
-            result = run_queries(query, name)
+            result = query_locations("name", input("Please enter the name of the location: "))
             return result
 
         elif response == "back":
@@ -712,48 +3504,29 @@ def quest_prompt():
     '''
     while True:
         response = input("Select your filter on quests (all, giver, location, reward, category, name) or go back: ").lower().strip()
-        query = "SELECT Quests.Name, Quests.Giver, Locations.Name, Quests.Reward, Quests.Category FROM Quests, Locations WHERE Quests.Location = Locations.Id "
 
         if response == "all":
-            result = run_queries(query)
+            result = query_quests("all")
             return result
 
         elif response == "giver":
-            name = ("%" + input("Please enter the giver of the quest or 'no giver': ").strip() + "%", )
-            if name == ("%no giver%", ):
-                query += "AND Quests.Giver IS NULL"
-                result = run_queries(query)
-            else:
-                query += "AND Quests.Giver LIKE ?"
-                result = run_queries(query, name)
+            result = query_quests("giver", input("Please enter the giver of the quest or 'no giver': "))
             return result
 
         elif response == "location":
-            name = ("%" + input("Please enter the location of the quest: ").strip() + "%", )
-            query += "AND Locations.Name LIKE ?"
-            result = run_queries(query, name)
+            result = query_quests("location", input("Please enter the location of the quest: "))
             return result
 
         elif response == "reward":
-            name = ("%" + input("Please enter the reward of the quest or 'no reward': ").strip() + "%", )
-            if name == ("%no reward%", ):
-                query += "AND Quests.Reward IS NULL"
-                result = run_queries(query)
-            else:
-                query += "AND Quests.Reward LIKE ?"
-                result = run_queries(query, name)
+            result = query_quests("reward", input("Please enter the reward of the quest or 'no reward': "))
             return result
 
         elif response == "category":
-            name = (input("Please enter the category of the quest (main or side): ").strip(), )
-            query += "AND Quests.Category = ?"
-            result = run_queries(query, name)
+            result = query_quests("category", input("Please enter the category of the quest (main or side): "))
             return result
 
         elif response == "name":
-            name = ("%" + input("Please enter the name of the quest: ").strip() + "%", )
-            query += "AND Quests.Name LIKE ?"
-            result = run_queries(query, name)
+            result = query_quests("name", input("Please enter the name of the quest: "))
             return result
 
         elif response == "back":
@@ -777,20 +3550,16 @@ def fish_prompt():
     '''
     while True:
         response = input("Select your filter on Fishes (all, location, price, name) or go back: ").lower().strip()
-        query = "SELECT Fishes.Name, Fishes.Location, Fishes.Price FROM Fishes "
 
         if response == "all":
-            result = run_queries(query)
+            result = query_fishes("all")
             return result
 
         elif response == "location":
-            name = ("%" + input("Please enter the location of the fish: ").strip() + "%", )
-            query += "WHERE Fishes.Location LIKE ?"
-            result = run_queries(query, name)
+            result = query_fishes("location", input("Please enter the location of the fish: "))
             return result
         
         elif response == "price":
-            query += "WHERE Fishes.Price >= ?"
             while True:
                 price = input("Please enter the price of the fish (an integer) or go back: ").strip()
                 if price == "back":
@@ -798,17 +3567,14 @@ def fish_prompt():
                     break
                 else:
                     try:
-                        price = (int(float(price)), )
-                        result = run_queries(query, price)
+                        result = query_fishes("price", price)
                         print(len(result))
                         return result
                     except:
                         print("Invalid input please try again.")
         
         elif response == "name":
-            name = ("%" + input("Please enter the name of the fish: ").strip() + "%", )
-            query += "WHERE Fishes.Name LIKE ?"
-            result = run_queries(query, name)
+            result = query_fishes("name", input("Please enter the name of the fish: "))
             return result
 
         elif response == "back":
@@ -831,36 +3597,11 @@ def stats_prompt():
     None
     '''
     while True:
-        print("1. Location -  Number of Quest\n2. Location - Kinds of Fishes\n3. Location - Average Fish Price\n"\
-            "4. Fish - Number of Fishing Location\n5. NPC - Number of Quest")
+        print("\n".join(f"{option}. {STATS_QUERIES[option][0]}" for option in STATS_QUERIES))
         response = input("Select a statistical information or go back: ").lower().strip()
 
-        if response == "1":
-            query = "SELECT Locations.Name, COUNT(*) FROM Locations JOIN Quests ON Quests.Location = Locations.Id GROUP BY Locations.Name ORDER BY COUNT(*) DESC"
-            result = run_queries(query)
-            return result
-
-        elif response == "2":
-            query = "SELECT Locations.Name, COUNT(*) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "\
-                    "GROUP BY Locations.Name ORDER BY COUNT(*) DESC"
-            result = run_queries(query)
-            return result
-
-        elif response == "3":
-            query = "SELECT Locations.Name, AVG(Fishes.Price) FROM Locations JOIN FishingLocation ON FishingLocation.Location = Locations.Id "\
-                    "JOIN Fishes ON Fishes.Id = FishingLocation.Fish GROUP BY Locations.Name ORDER BY AVG(Fishes.Price) DESC"
-            result = run_queries(query)
-            return result
-
-        elif response == "4":
-            query = "SELECT Fishes.Name, COUNT(*) FROM Fishes JOIN FishingLocation ON FishingLocation.Fish = Fishes.Id "\
-                    "JOIN Locations ON Locations.Id = FishingLocation.Location GROUP BY Fishes.Name ORDER BY COUNT(*) DESC"
-            result = run_queries(query)
-            return result
-        
-        elif response == "5":
-            query = "SELECT NPCs.Name, COUNT(*) FROM NPCs JOIN Quests ON Quests.Giver = NPCs.Name GROUP BY NPCs.Name ORDER BY COUNT(*) DESC"
-            result = run_queries(query)
+        if response in STATS_QUERIES:
+            result = query_stats(response)
             return result
 
         elif response == "back":
@@ -886,20 +3627,14 @@ def image_prompt():
         response = input("Choose the entity that you would like to view (NPC or Fish) or go back: ").lower().strip()
 
         if response == "npc":
-            query = "SELECT NPCs.Image FROM NPCs "
-            name = ("%" + input("Please enter the name of the NPC: ").strip() + "%", )
-            query += "WHERE NPCs.Name LIKE ?"
-            result = run_queries(query, name)
-            img = [data[0] for data in result]
+            result = query_image_ids("npc", input("Please enter the name of the NPC: "))
+            img = read_images([data[1] for data in result], IMAGE_DEFAULT_SIZE)
             show_image(img)
             break
 
         elif response == "fish":
-            query = "SELECT Fishes.Image FROM Fishes "
-            name = ("%" + input("Please enter the name of the fish: ").strip() + "%", )
-            query += "WHERE Fishes.Name LIKE ?"
-            result = run_queries(query, name)
-            img = [data[0] for data in result]
+            result = query_image_ids("fish", input("Please enter the name of the fish: "))
+            img = read_images([data[1] for data in result], IMAGE_DEFAULT_SIZE)
             show_image(img)
             break
 
@@ -1004,9 +3739,126 @@ def base_prompt():
             print("Invalid input please try again.")
 
 if __name__ == "__main__":
-    
+    parser = argparse.ArgumentParser(description = "Build and query the NieR: Automata wiki database.")
+    parser.add_argument("--parse-workers", type = int, default = PARSE_WORKERS,
+                        help = "processes used to parse detail pages, 0 for one per core")
+    parser.add_argument("--offline", action = "store_true", help = "never touch the network, build only from the caches")
+    parser.add_argument("--base-url", default = base_url, help = "scrape this copy of the wiki, e.g. a mock server")
+    parser.add_argument("--report", help = "write all figures and images to this HTML file instead of the browser")
+    parser.add_argument("--export", choices = ["png", "svg"], help = "also save every figure of the report as a static file")
+    subparsers = parser.add_subparsers(dest = "command")
+    subparsers.add_parser("update", help = "incrementally refresh the database from the wiki")
+    export_parser = subparsers.add_parser("export", help = "pack the page and image caches into a snapshot file")
+    export_parser.add_argument("snapshot")
+    import_parser = subparsers.add_parser("import", help = "load a snapshot file into the caches and build offline")
+    import_parser.add_argument("snapshot")
+
+    # Query command: the filters of its prompt. Filters starting with "with" take no value.
+    filters = {
+        "npc": ["with main quest", "with side quest", "name"],
+        "location": ["quest", "fish", "name"],
+        "quest": ["giver", "location", "reward", "category", "name"],
+        "fish": ["location", "price", "name"],
+    }
+    query_parsers = []
+    for entity, names in filters.items():
+        query_parser = subparsers.add_parser(entity, help = f"query {entity} data with at most one filter, all rows without one")
+        group = query_parser.add_mutually_exclusive_group()
+        for name in names:
+            if name.startswith("with"):
+                group.add_argument("--" + name.replace(" ", "-"), action = "store_true", default = None)
+            else:
+                group.add_argument("--" + name, metavar = "VALUE")
+        query_parsers.append(query_parser)
+    stats_parser = subparsers.add_parser("stats", help = "one of the statistics of the stats prompt")
+    stats_parser.add_argument("option", choices = list(STATS_QUERIES))
+    query_parsers.append(stats_parser)
+    batch_parser = subparsers.add_parser("batch", help = "run one query per JSON line of a file, - for stdin")
+    batch_parser.add_argument("specs")
+    for query_parser in query_parsers + [batch_parser]:
+        if query_parser is batch_parser:
+            query_parser.add_argument("--format", choices = ["json", "jsonl"], default = "jsonl")
+        else:
+            query_parser.add_argument("--format", choices = ["json", "jsonl", "csv"], default = "json")
+        query_parser.add_argument("--output", help = "write to this file instead of stdout")
+    image_parser = subparsers.add_parser("image", help = "save the images of the NPCs or fishes whose name matches")
+    image_parser.add_argument("entity", choices = ["npc", "fish"])
+    image_parser.add_argument("name")
+    image_parser.add_argument("--output", default = ".", help = "folder to save the images to, unless --report is given")
+    image_parser.add_argument("--size", type = int, default = IMAGE_DEFAULT_SIZE, help = "thumbnail size in pixels, 0 for the originals")
+    serve_parser = subparsers.add_parser("serve", help = "serve the queries as JSON over HTTP")
+    serve_parser.add_argument("--host", default = "127.0.0.1")
+    serve_parser.add_argument("--port", type = int, default = 8000)
+    args = parser.parse_args()
+    PARSE_WORKERS = args.parse_workers
+    set_base_url(args.base_url)
+    OFFLINE = args.offline or args.command == "import"
+    if args.report:
+        start_report(args.report, args.export)
+
     p = Path()
-    if not (p / DBNAME).exists():
+    if args.command == "export":
+        print(f"Exported {export_snapshot(args.snapshot)} to {args.snapshot}")
+    elif args.command == "import":
+        print(f"Imported {import_snapshot(args.snapshot)} from {args.snapshot}")
+    if args.command in ["update", "import"] and (p / DBNAME).exists():
+        report = update_data()
+        if not report:
+            print("Database is up to date.")
+        for table, counts in report.items():
+            print(f"{table}: {counts['inserted']} inserted, {counts['updated']} updated, {counts['deleted']} deleted")
+    elif args.command != "export" and not (p / DBNAME).exists():
         create_tables()
         insert_data()
-    base_prompt()
\ No newline at end of file
+    if http_client is not None:
+        for host, stats in http_client.summary().items():
+            print(f"{host}: {stats}", file = sys.stderr)
+    if page_cache is not None:
+        print(f"page cache: {page_cache.summary()}", file = sys.stderr)
+    if image_cache is not None:
+        print(f"image cache: {image_cache.summary()}", file = sys.stderr)
+
+    if args.command in QUERIES or args.command == "batch":
+        file = open(args.output, "w", newline = "") if args.output else sys.stdout
+        if args.command == "batch":
+            specs = sys.stdin if args.specs == "-" else open(args.specs)
+            results = list(run_batch(json.loads(line) for line in specs if line.strip()))
+            write_rows(results, ["entity", "filter", "value", "rows", "error"], args.format, file)
+        elif args.command == "stats":
+            write_rows(query("stats", args.option), QUERIES["stats"][1], args.format, file)
+        else:
+            filter, value = "all", None
+            for name in filters[args.command]:
+                given = getattr(args, name.replace(" ", "_"))
+                if given is not None and not str(given).strip():
+                    parser.error(f"--{name} needs a value")
+                if given is not None:
+                    filter, value = name, (None if given is True else given)
+            write_rows(query(args.command, filter, value), QUERIES[args.command][1], args.format, file)
+        if args.output:
+            file.close()
+    elif args.command == "image":
+        result = [row for row in query_image_ids(args.entity, args.name) if row[1] is not None]
+        images = read_images([data[1] for data in result], args.size)
+        if html_report is not None:
+            html_report.add_images(images, [data[0] for data in result])
+        else:
+            folder = Path(args.output)
+            folder.mkdir(parents = True, exist_ok = True)
+            for (name, image_id), data in zip(result, images):
+                path = folder / (re.sub(r"[^\w.-]+", "_", name) + image_type(data)[1])
+                path.write_bytes(data)
+                print(path)
+    elif args.command == "serve":
+        server = make_server(args.host, args.port)
+        print(f"Serving {DBNAME} on http://{args.host}:{server.server_address[1]}/", file = sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
+    if args.command is None:
+        base_prompt()
+    if html_report is not None:
+        print(f"Report written to {html_report.write()}", file = sys.stderr)
+    if query_cache is not None:
+        print(f"query cache: {query_cache.summary()}", file = sys.stderr)
\ No newline at end of file
@@ -0,0 +1,748 @@
+####Full Name: Haoyang Zeng
+####Unique Name: haoyangz
+
+import Final_Project as fp
+import mock_wiki
+import argparse
+import json
+import os
+import threading
+import http.client
+import random
+import struct
+import zlib
+import subprocess
+import shutil
+import statistics
+import tempfile
+import sqlite3
+import time
+import tracemalloc
+from pathlib import Path
+from urllib.parse import urlparse
+from concurrent.futures import ProcessPoolExecutor
+
+
+def page_types():
+    '''Group the cached pages by page type.
+    Index pages are known by their url, detail pages by the urls stored in the database.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    pages: dict
+        Page type to a list of (url, scope) of the cached pages of that type.
+    '''
+    types = {fp.NPC_url: "NPC index", fp.location_url: "location index", fp.main_quest_url: "main quests",
+             fp.side_quest_url: "side quests", fp.fish_url: "fishing"}
+    scopes = {"main quests": "tables", "side quests": "tables", "fishing": "tables"}
+    if Path(fp.DBNAME).exists():
+        connection = sqlite3.connect(fp.DBNAME)
+        for row in connection.execute("SELECT Url FROM NPCs"):
+            types[row[0]] = "NPC detail"
+        for row in connection.execute("SELECT Url FROM Locations"):
+            types[row[0]] = "location detail"
+        connection.close()
+
+    pages = {}
+    cache = fp.get_page_cache()
+    for row in cache.connection.execute("SELECT Url FROM Pages"):
+        page_type = types.get(row[0], "other detail")
+        pages.setdefault(page_type, []).append((row[0], scopes.get(page_type, "content")))
+    return pages
+
+
+def parse_benchmark(repeat = 3):
+    '''Compare parse time and peak memory per page type for every parser setup.
+
+    Parameters
+    ----------
+    repeat: int
+        How many times every page is parsed for the timing.
+
+    Returns
+    -------
+    results: list
+        One dict per (page type, parser, scoped) with the mean time and peak memory per page.
+    '''
+    parsers = ["html.parser"]
+    if fp.HTML_PARSER != "html.parser":
+        parsers.append(fp.HTML_PARSER)
+    cache = fp.get_page_cache()
+    results = []
+
+    for page_type, pages in sorted(page_types().items()):
+        texts = [(cache.get(url), scope) for url, scope in pages]
+        for parser in parsers:
+            for scoped in [False, True]:
+                start = time.perf_counter()
+                for i in range(repeat):
+                    for text, scope in texts:
+                        fp.make_soup(text, scope if scoped else None, parser)
+                seconds = (time.perf_counter() - start) / (repeat * len(texts))
+
+                peaks = []
+                for text, scope in texts:
+                    tracemalloc.start()
+                    soup = fp.make_soup(text, scope if scoped else None, parser)
+                    peaks.append(tracemalloc.get_traced_memory()[1])
+                    tracemalloc.stop()
+                    del soup
+
+                results.append({"page_type": page_type, "pages": len(texts), "parser": parser, "scoped": scoped,
+                                "ms_per_page": round(seconds * 1000, 3), "peak_kb_per_page": round(sum(peaks) / len(peaks) / 1024, 1)})
+    return results
+
+
+def workers_benchmark(counts = None):
+    '''Time parsing all cached NPC and location detail pages with a growing number of parse processes.
+
+    Parameters
+    ----------
+    counts: list
+        The worker counts to try, powers of two up to the number of cores by default.
+
+    Returns
+    -------
+    results: list
+        One dict per worker count with the total time and the speedup over one worker.
+    '''
+    if counts is None:
+        counts = [1]
+        while counts[-1] * 2 <= (os.cpu_count() or 1):
+            counts.append(counts[-1] * 2)
+    pages = page_types()
+    cache = fp.get_page_cache()
+    jobs = [("NPC", cache.get(url)) for url, scope in pages.get("NPC detail", [])]
+    jobs += [("Location", cache.get(url)) for url, scope in pages.get("location detail", [])]
+    kinds = [kind for kind, text in jobs]
+    texts = [text for kind, text in jobs]
+
+    results = []
+    for workers in counts:
+        start = time.perf_counter()
+        if workers == 1:
+            for kind, text in jobs:
+                fp.parse_text(kind, text)
+        else:
+            with ProcessPoolExecutor(max_workers = workers) as executor:
+                list(executor.map(fp.parse_text, kinds, texts, chunksize = 8))
+        seconds = time.perf_counter() - start
+        results.append({"workers": workers, "pages": len(jobs), "seconds": round(seconds, 3),
+                        "speedup": round(results[0]["seconds"] / seconds, 2) if results else 1.0})
+    return results
+
+
+LOAD_PATHS = ["/npc", "/npc?name=Pascal", "/location?name=City", "/quest?giver=Pascal", "/quest?category=side",
+              "/fish?price=100", "/stats/1", "/stats/3", "/images/npc?name=a", "/image/1"]
+
+
+def percentile(values, fraction):
+    '''Return the value at the given fraction of the sorted values.'''
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))]
+
+
+def load_test(url = None, clients = 200, requests = 20, paths = LOAD_PATHS):
+    '''Send requests from many concurrent keep-alive clients to the query server
+    and report the latency per path.
+
+    Parameters
+    ----------
+    url: str
+        The base url of a running server. Without one, a server for the
+        database in the current folder is started in this process.
+    clients: int
+        The number of concurrent clients.
+    requests: int
+        The number of requests every client sends, cycling through paths.
+    paths: list
+        The request paths.
+
+    Returns
+    -------
+    results: list
+        One dict per path and one for all paths with the request count, errors,
+        p50, p99 and max latency in milliseconds, and the requests per second.
+    '''
+    server = None
+    if url is None:
+        server = fp.make_server("127.0.0.1", 0)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+    target = urlparse(url)
+    latencies = {path: [] for path in paths}
+    errors = {path: 0 for path in paths}
+    lock = threading.Lock()
+    barrier = threading.Barrier(clients)
+
+    def client(number):
+        connection = http.client.HTTPConnection(target.hostname, target.port, timeout = 60)
+        barrier.wait()
+        for i in range(requests):
+            path = paths[(number + i) % len(paths)]
+            start = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                failed = response.status >= 500
+            except (OSError, http.client.HTTPException):
+                connection.close()
+                connection = http.client.HTTPConnection(target.hostname, target.port, timeout = 60)
+                failed = True
+            latency = time.perf_counter() - start
+            with lock:
+                latencies[path].append(latency)
+                errors[path] += failed
+        connection.close()
+
+    threads = [threading.Thread(target = client, args = (number, )) for number in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    if server is not None:
+        server.shutdown()
+        server.server_close()
+        print(f"query cache: {fp.get_query_cache().summary()}")
+
+    results = []
+    everything = []
+    for path in paths:
+        everything += latencies[path]
+        results.append({"path": path, "requests": len(latencies[path]), "errors": errors[path],
+                        "p50_ms": round(percentile(latencies[path], 0.5) * 1000, 2),
+                        "p99_ms": round(percentile(latencies[path], 0.99) * 1000, 2),
+                        "max_ms": round(max(latencies[path]) * 1000, 2), "rps": None})
+    results.append({"path": "all", "requests": len(everything), "errors": sum(errors.values()),
+                    "p50_ms": round(percentile(everything, 0.5) * 1000, 2),
+                    "p99_ms": round(percentile(everything, 0.99) * 1000, 2),
+                    "max_ms": round(max(everything) * 1000, 2), "rps": round(len(everything) / seconds, 1)})
+    return results
+
+
+def scale_database(source, target, factor):
+    '''Copy a database and repeat its NPCs, locations, quests, fishes and fishing
+    links factor times. Every copy gets its own ids and a numbered name suffix,
+    and keeps its links within the copy. Images are shared by all copies.
+
+    Parameters
+    ----------
+    source: str
+        The path of the database to scale.
+    target: str
+        The path of the scaled database. An existing file is replaced.
+    factor: int
+        How many copies of the data the scaled database holds.
+
+    Returns
+    -------
+    None
+    '''
+    shutil.copyfile(source, target)
+    connection = sqlite3.connect(target, isolation_level = None)
+    cursor = connection.cursor()
+    for pragma in fp.LOAD_PRAGMAS:
+        cursor.execute(pragma)
+    cursor.execute("BEGIN")
+    for (name, ) in cursor.execute("SELECT name FROM sqlite_master WHERE type = 'trigger'").fetchall():
+        cursor.execute(f"DROP TRIGGER {name}")
+    sizes = {table: cursor.execute(f"SELECT COALESCE(MAX(Id), 0) FROM {table}").fetchone()[0]
+             for table in ["NPCs", "Locations", "Quests", "Fishes"]}
+    for copy in range(1, factor):
+        offset = {table: size * copy for table, size in sizes.items()}
+        cursor.execute(f"""INSERT INTO NPCs (Id, Name, Url, Info, Gender, ImageId) SELECT Id + {offset["NPCs"]},
+            Name || ' {copy}', Url || '#{copy}', Info, Gender, ImageId FROM NPCs WHERE Id <= {sizes["NPCs"]}""")
+        cursor.execute(f"""INSERT INTO Locations (Id, Name, Url, Info, PreviousLocation, NextLocation) SELECT Id + {offset["Locations"]},
+            Name || ' {copy}', Url || '#{copy}', Info, PreviousLocation, NextLocation FROM Locations WHERE Id <= {sizes["Locations"]}""")
+        cursor.execute(f"""INSERT INTO Quests (Id, Name, Url, Giver, Location, Reward, Category) SELECT Id + {offset["Quests"]},
+            Name || ' {copy}', Url || '#{copy}', Giver || ' {copy}', Location + {offset["Locations"]}, Reward, Category
+            FROM Quests WHERE Id <= {sizes["Quests"]}""")
+        cursor.execute(f"""INSERT INTO Fishes (Id, Name, Url, Location, Price, ImageId) SELECT Id + {offset["Fishes"]},
+            Name || ' {copy}', Url || '#{copy}', Location, Price, ImageId FROM Fishes WHERE Id <= {sizes["Fishes"]}""")
+        cursor.execute(f"""INSERT INTO FishingLocation (Fish, Location) SELECT Fish + {offset["Fishes"]}, Location + {offset["Locations"]}
+            FROM FishingLocation WHERE Fish <= {sizes["Fishes"]}""")
+    fp.rebuild_search(cursor)
+    fp.rebuild_stats(cursor)
+    fp.create_indexes(cursor)
+    fp.bump_data_version(cursor)
+    cursor.execute("COMMIT")
+    cursor.execute("ANALYZE")
+    connection.close()
+
+
+def stats_benchmark(scales = (1, 10, 100), repeat = 20):
+    '''Compare every stats option computed with its aggregate query against
+    the lookup in its stats table, on scaled copies of the database.
+
+    Parameters
+    ----------
+    scales: list
+        The scale factors, see scale_database.
+    repeat: int
+        How many times every query is timed, the median is reported.
+
+    Returns
+    -------
+    results: list
+        One dict per (scale, option) with both median latencies and the speedup.
+    '''
+    results = []
+    with tempfile.TemporaryDirectory() as folder:
+        for scale in scales:
+            target = str(Path(folder) / f"scaled_{scale}.sqlite")
+            scale_database(fp.DBNAME, target, scale)
+            connection = sqlite3.connect(target)
+            for option, (description, query, stats_table) in fp.STATS_QUERIES.items():
+                lookup = f"SELECT Name, Value FROM {stats_table} ORDER BY Value DESC"
+                timings = {}
+                for name, sql in [("aggregate", query), ("materialized", lookup)]:
+                    samples = []
+                    for i in range(repeat):
+                        start = time.perf_counter()
+                        rows = connection.execute(sql).fetchall()
+                        samples.append(time.perf_counter() - start)
+                    timings[name] = statistics.median(samples)
+                results.append({"scale": scale, "option": option, "rows": len(rows),
+                                "aggregate_ms": round(timings["aggregate"] * 1000, 3),
+                                "materialized_ms": round(timings["materialized"] * 1000, 3),
+                                "speedup": round(timings["aggregate"] / timings["materialized"], 1)})
+            connection.close()
+    return results
+
+
+def image_benchmark(sizes = (0, 64, 256), repeat = 5):
+    '''Compare reading every stored image as the original and as thumbnails.
+
+    Parameters
+    ----------
+    sizes: list
+        The sizes to read, 0 for the originals.
+    repeat: int
+        How many times all images are read, the median time is reported.
+
+    Returns
+    -------
+    results: list
+        One dict per size with the total bytes read and the median time.
+    '''
+    connection = sqlite3.connect(fp.DBNAME)
+    image_ids = [row[0] for row in connection.execute("SELECT Id FROM Images")]
+    connection.close()
+    results = []
+    for size in sizes:
+        samples = []
+        for i in range(repeat):
+            start = time.perf_counter()
+            images = fp.read_images(image_ids, size)
+            samples.append(time.perf_counter() - start)
+        total = sum(len(image) for image in images)
+        results.append({"size": size or "original", "images": len(images), "bytes": total,
+                        "bytes_per_image": round(total / len(images)) if images else 0,
+                        "ms": round(statistics.median(samples) * 1000, 3)})
+    return results
+
+
+# Record counts of the real dataset, used when there is no database to count.
+REAL_COUNTS = {"NPC": 60, "Location": 20, "Quest": 150, "Fish": 40}
+
+
+def real_counts():
+    '''Count the records of the real dataset in the database, or fall back to REAL_COUNTS.
+
+    Parameters
+    ----------
+    None
+
+    Returns
+    -------
+    counts: dict
+        Record type name to the number of records.
+    '''
+    if not Path(fp.DBNAME).exists():
+        return dict(REAL_COUNTS)
+    connection = sqlite3.connect(fp.DBNAME)
+    counts = {name: connection.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+              for name, table in [("NPC", "NPCs"), ("Location", "Locations"), ("Quest", "Quests"), ("Fish", "Fishes")]}
+    connection.close()
+    if not all(counts.values()):
+        return dict(REAL_COUNTS)
+    return counts
+
+
+def png_bytes(width, height, seed):
+    '''Encode a striped RGB test image as PNG with the standard library only.
+
+    Parameters
+    ----------
+    width: int
+        The width in pixels.
+    height: int
+        The height in pixels.
+    seed: int
+        Selects the colors, different seeds give different images.
+
+    Returns
+    -------
+    data: bytes
+        The PNG file.
+    '''
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+    red, green, blue = seed % 251, seed * 7 % 253, seed * 13 % 255
+    raw = b"".join(b"\x00" + bytes([red, (green + y) % 256, blue]) * width for y in range(height))
+    header = struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)
+    return b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", header) + chunk(b"IDAT", zlib.compress(raw)) + chunk(b"IEND", b"")
+
+
+def generate_dataset(scale, image_folder, seed = 0, images = 200, counts = None):
+    '''Generate NPC, location, quest and fish records at scale times the size of
+    the real dataset, with the same shape: quests name their giver and location,
+    fishes list the locations they can be caught at, and NPCs and fishes refer
+    to images written to image_folder. The same seed gives the same dataset.
+
+    Parameters
+    ----------
+    scale: int
+        The size relative to the real dataset.
+    image_folder: str
+        The folder the generated images are written to.
+    seed: int
+        The seed of the random generator.
+    images: int
+        The number of distinct images, shared round robin by NPCs and fishes.
+    counts: dict
+        The record counts of the real dataset, real_counts() by default.
+
+    Returns
+    -------
+    dataset: dict
+        The "NPC", "Location", "Quest" and "Fish" RecordBatch.
+    '''
+    counts = counts or real_counts()
+    rng = random.Random(seed)
+    folder = Path(image_folder)
+    folder.mkdir(parents = True, exist_ok = True)
+    img_names = []
+    for i in range(images):
+        img_names.append(f"synthetic_{i}.png")
+        (folder / img_names[-1]).write_bytes(png_bytes(320, 240, i))
+    words = ["machine", "android", "pod", "ruins", "flood", "forest", "desert", "bunker", "resistance", "chip", "memory", "oil"]
+
+    def text(length):
+        return " ".join(rng.choice(words) for i in range(length)).capitalize() + "."
+
+    locations = fp.RecordBatch(fp.Location)
+    location_names = [f"Sector {i}" for i in range(counts["Location"] * scale)]
+    for i, name in enumerate(location_names):
+        previous = location_names[i - 1] if i > 0 else None
+        following = location_names[i + 1] if i + 1 < len(location_names) else None
+        locations.add(f"{fp.base_url}Sector+{i}", name, text(30), previous, following)
+
+    NPCs = fp.RecordBatch(fp.NPC)
+    NPC_names = [f"Android {i}" for i in range(counts["NPC"] * scale)]
+    for i, name in enumerate(NPC_names):
+        NPCs.add(f"{fp.base_url}Android+{i}", name, text(40), rng.choice(["Male", "Female", None]), img_names[i % images])
+
+    quests = fp.RecordBatch(fp.Quest)
+    for i in range(counts["Quest"] * scale):
+        giver = rng.choice(NPC_names) if rng.random() < 0.8 else None
+        reward = f"{rng.randint(1, 50) * 100}G" if rng.random() < 0.7 else None
+        quests.add(f"{fp.base_url}Quest+{i}", f"Quest {i}", giver, rng.choice(location_names), reward, rng.choice(["main", "side"]))
+
+    fishes = fp.RecordBatch(fp.Fish)
+    for i in range(counts["Fish"] * scale):
+        where = ", ".join(rng.sample(location_names, min(len(location_names), rng.randint(1, 3))))
+        fishes.add(f"{fp.base_url}Fish+{i}", f"Fish {i}", where, img_names[(i + len(NPC_names)) % images], rng.randint(1, 100) * 50)
+
+    return {"NPC": NPCs, "Location": locations, "Quest": quests, "Fish": fishes}
+
+
+def query_specs(dataset, seed = 0):
+    '''Pick one query per prompt filter, with values taken from the dataset.
+
+    Parameters
+    ----------
+    dataset: dict
+        The output of generate_dataset.
+    seed: int
+        The seed of the random generator.
+
+    Returns
+    -------
+    specs: list
+        (entity, filter, value) of every query.
+    '''
+    rng = random.Random(seed)
+    NPC = rng.choice(list(dataset["NPC"]))
+    location = rng.choice(list(dataset["Location"]))
+    quest = rng.choice([quest for quest in dataset["Quest"] if quest.giver and quest.reward])
+    fish = rng.choice(list(dataset["Fish"]))
+    specs = [("npc", "all", None), ("npc", "with main quest", None), ("npc", "with side quest", None), ("npc", "name", NPC.name),
+             ("location", "all", None), ("location", "quest", quest.name), ("location", "fish", fish.name), ("location", "name", location.name),
+             ("quest", "all", None), ("quest", "giver", quest.giver), ("quest", "giver", "no giver"), ("quest", "location", quest.location),
+             ("quest", "reward", quest.reward), ("quest", "reward", "no reward"), ("quest", "category", "main"), ("quest", "name", quest.name),
+             ("fish", "all", None), ("fish", "location", fish.location.split(", ")[0]), ("fish", "price", "2500"), ("fish", "name", fish.name)]
+    specs += [("stats", option, None) for option in fp.STATS_QUERIES]
+    return specs
+
+
+def timed(function, repeat):
+    '''Call function repeat times and return the median and p95 time in milliseconds and the last result.'''
+    samples = []
+    for i in range(repeat):
+        start = time.perf_counter()
+        result = function()
+        samples.append(time.perf_counter() - start)
+    samples.sort()
+    return round(statistics.median(samples) * 1000, 3), round(samples[min(len(samples) - 1, int(0.95 * len(samples)))] * 1000, 3), result
+
+
+def suite_benchmark(scales = (10, 100, 1000), repeat = 5, seed = 0):
+    '''Generate a synthetic dataset at every scale, load it and time the load,
+    the SQL of every prompt filter, the stats and the image reads. The query
+    result cache is disabled so every query reaches SQLite.
+
+    Parameters
+    ----------
+    scales: list
+        The sizes relative to the real dataset.
+    repeat: int
+        How many times every query is timed.
+    seed: int
+        The seed of the generator, the same seed gives the same datasets and queries.
+
+    Returns
+    -------
+    results: list
+        One dict per (scale, benchmark) with the rows returned and the median and p95 time.
+    '''
+    counts = real_counts()
+    original = fp.DBNAME
+    images = fp.image_cache
+    fp.query_cache = fp.QueryCache(max_entries = 0)
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as folder:
+            for scale in scales:
+                dataset = generate_dataset(scale, Path(folder) / f"img_{scale}", seed, counts = counts)
+                fp.image_cache = fp.ImageCache(Path(folder) / f"img_{scale}", max_bytes = None)
+                fp.use_database(str(Path(folder) / f"synthetic_{scale}.sqlite"))
+                start = time.perf_counter()
+                fp.create_tables()
+                fp.load_data(dataset["NPC"], dataset["Location"], dataset["Quest"], dataset["Fish"])
+                load_ms = round((time.perf_counter() - start) * 1000, 3)
+                rows = sum(len(batch) for batch in dataset.values())
+                results.append({"scale": scale, "benchmark": "load", "rows": rows, "median_ms": load_ms, "p95_ms": load_ms})
+
+                for entity, filter, value in query_specs(dataset, seed):
+                    median, p95, result = timed(lambda: fp.query(entity, filter, value), repeat)
+                    name = f"{entity} {filter}" + (f" ({value})" if filter in ["giver", "reward"] and value.startswith("no ") else "")
+                    results.append({"scale": scale, "benchmark": name, "rows": len(result), "median_ms": median, "p95_ms": p95})
+
+                connection = sqlite3.connect(fp.DBNAME)
+                image_ids = [row[0] for row in connection.execute("SELECT ImageId FROM NPCs LIMIT 50")]
+                connection.close()
+                for size in [0, fp.IMAGE_DEFAULT_SIZE]:
+                    median, p95, result = timed(lambda: fp.read_images(image_ids, size), repeat)
+                    results.append({"scale": scale, "benchmark": f"images {size or 'original'}", "rows": len(result),
+                                    "median_ms": median, "p95_ms": p95})
+                fp.use_database(original)
+    finally:
+        fp.use_database(original)
+        fp.image_cache = images
+        fp.query_cache = None
+    return results
+
+
+def compare_results(results, baseline):
+    '''Add the baseline time and the relative change to every result that is in the baseline.
+
+    Parameters
+    ----------
+    results: list
+        The results of suite_benchmark.
+    baseline: list
+        Earlier results of suite_benchmark, e.g. from another commit.
+
+    Returns
+    -------
+    results: list
+        The results with "baseline_ms" and "change" added.
+    '''
+    earlier = {(result["scale"], result["benchmark"]): result["median_ms"] for result in baseline}
+    for result in results:
+        before = earlier.get((result["scale"], result["benchmark"]))
+        result["baseline_ms"] = before
+        result["change"] = f"{(result['median_ms'] - before) / before:+.0%}" if before else None
+    return results
+
+
+CRAWL_SCRAPERS = ["get_NPCs", "get_locations", "get_main_quests", "get_side_quests", "get_fishes"]
+
+
+def crawl_benchmark(snapshot = None, latency = 0.0, error_rate = 0.0, modes = None, seed = 0):
+    '''Crawl a local mock wiki that replays recorded pages and report the cost
+    of every scraper with serial and concurrent fetching.
+    Each mode starts from empty caches and runs three passes: cold fetches
+    every page and image, warm reads them from the caches and revalidate sends
+    a conditional request for every cached page.
+
+    Parameters
+    ----------
+    snapshot: str
+        A snapshot written by Final_Project.py export. Without one, the page
+        and image caches in the current folder are exported to a temporary snapshot.
+    latency: float
+        The delay of every mock response in seconds.
+    error_rate: float
+        The fraction of mock requests that fail with a 503 and are retried.
+    modes: dict
+        The number of fetch workers per mode name, serial (1) and concurrent
+        (FETCH_WORKERS) by default.
+    seed: int
+        The seed of the injected errors.
+
+    Returns
+    -------
+    results: list
+        One dict per mode, pass and scraper with the wall time, requests,
+        requests per second, retries, bytes and page and image cache hit ratio.
+    '''
+    if modes is None:
+        modes = {"serial": 1, "concurrent": fp.FETCH_WORKERS}
+    with tempfile.TemporaryDirectory() as folder:
+        if snapshot is None:
+            snapshot = os.path.join(folder, "snapshot.sqlite")
+            fp.export_snapshot(snapshot)
+        server = mock_wiki.make_mock_server(snapshot, latency = latency, error_rate = error_rate, seed = seed)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        saved = (fp.base_url, fp.page_cache, fp.image_cache, fp.http_client, fp.FETCH_WORKERS)
+        fp.set_base_url(f"http://127.0.0.1:{server.server_address[1]}/")
+        results = []
+        try:
+            for mode, workers in modes.items():
+                fp.FETCH_WORKERS = workers
+                fp.page_cache = fp.PageCache(os.path.join(folder, f"{mode}.sqlite"), max_bytes = None)
+                fp.image_cache = fp.ImageCache(os.path.join(folder, f"{mode}_images"), max_bytes = None)
+                for crawl, refresh in [("cold", False), ("warm", False), ("revalidate", True)]:
+                    fp.page_cache.fresh.clear()
+                    for name in CRAWL_SCRAPERS:
+                        fp.http_client = fp.HttpClient(pool_size = workers)
+                        lookups = [dict(cache.stats) for cache in (fp.page_cache, fp.image_cache)]
+                        start = time.perf_counter()
+                        getattr(fp, name)(refresh)
+                        seconds = time.perf_counter() - start
+                        hits = sum(cache.stats["hits"] - before["hits"]
+                                   for cache, before in zip((fp.page_cache, fp.image_cache), lookups))
+                        misses = sum(cache.stats["misses"] - before["misses"]
+                                     for cache, before in zip((fp.page_cache, fp.image_cache), lookups))
+                        hosts = list(fp.http_client.summary().values())
+                        requests = sum(host["requests"] for host in hosts)
+                        results.append({"mode": mode, "workers": workers, "pass": crawl, "scraper": name,
+                                        "seconds": round(seconds, 3), "requests": requests,
+                                        "rps": round(requests / seconds, 1) if seconds else None,
+                                        "retries": sum(host["retries"] for host in hosts),
+                                        "bytes": sum(host["bytes"] for host in hosts),
+                                        "hit_ratio": round(hits / (hits + misses), 3) if hits + misses else None})
+                        fp.http_client.close()
+                fp.page_cache.close()
+        finally:
+            fp.set_base_url(saved[0])
+            fp.page_cache, fp.image_cache, fp.http_client, fp.FETCH_WORKERS = saved[1:]
+            server.shutdown()
+            server.server_close()
+        print(f"mock wiki: {server.wiki.summary()}")
+    return results
+
+
+def git_commit():
+    '''Return the current git commit of the repository, or None outside of git.'''
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output = True, text = True,
+                              cwd = Path(__file__).parent).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def print_results(results):
+    '''Print benchmark results as an aligned table.
+
+    Parameters
+    ----------
+    results: list
+        A list of dicts with the same keys.
+
+    Returns
+    -------
+    None
+    '''
+    if not results:
+        print("No results.")
+        return
+    header = list(results[0].keys())
+    rows = [[str(result[key]) for key in header] for result in results]
+    widths = [max(len(cell) for cell in column) for column in zip(header, *rows)]
+    for row in [header] + rows:
+        print("  ".join(cell.ljust(width) for cell, width in zip(row, widths)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Benchmarks for the NieR: Automata wiki database.")
+    parser.add_argument("--json", help = "also write the results to this JSON file")
+    subparsers = parser.add_subparsers(dest = "benchmark", required = True)
+    parse_parser = subparsers.add_parser("parse", help = "parse time and peak memory per page type over the cached pages")
+    parse_parser.add_argument("--repeat", type = int, default = 3)
+    workers_parser = subparsers.add_parser("workers", help = "detail page parse time for a growing number of parse processes")
+    workers_parser.add_argument("--counts", type = int, nargs = "+", help = "worker counts to try")
+    stats_parser = subparsers.add_parser("stats", help = "stats aggregates against the stats tables on scaled copies of the database")
+    stats_parser.add_argument("--scales", type = int, nargs = "+", default = [1, 10, 100])
+    stats_parser.add_argument("--repeat", type = int, default = 20)
+    image_parser = subparsers.add_parser("images", help = "bytes and time to read all images as originals and as thumbnails")
+    image_parser.add_argument("--sizes", type = int, nargs = "+", default = [0, 64, 256])
+    suite_parser = subparsers.add_parser("suite", help = "load, prompt SQL, stats and image reads on synthetic datasets")
+    suite_parser.add_argument("--scales", type = int, nargs = "+", default = [10, 100, 1000])
+    suite_parser.add_argument("--repeat", type = int, default = 5)
+    suite_parser.add_argument("--seed", type = int, default = 0)
+    suite_parser.add_argument("--baseline", help = "JSON results of an earlier run to compare with")
+    load_parser = subparsers.add_parser("load", help = "latency of the query server under many concurrent clients")
+    load_parser.add_argument("--url", help = "base url of a running server, one is started in-process by default")
+    load_parser.add_argument("--clients", type = int, default = 200)
+    load_parser.add_argument("--requests", type = int, default = 20, help = "requests per client")
+    crawl_parser = subparsers.add_parser("crawl", help = "scraper cost against a local mock wiki with serial and concurrent fetching")
+    crawl_parser.add_argument("--snapshot", help = "snapshot to replay, the current caches are exported by default")
+    crawl_parser.add_argument("--latency", type = float, default = 0.0, help = "delay of every mock response in seconds")
+    crawl_parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of mock requests that fail with a 503")
+    crawl_parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    if args.benchmark == "parse":
+        results = parse_benchmark(args.repeat)
+    elif args.benchmark == "workers":
+        results = workers_benchmark(args.counts)
+    elif args.benchmark == "stats":
+        results = stats_benchmark(args.scales, args.repeat)
+    elif args.benchmark == "images":
+        results = image_benchmark(args.sizes)
+    elif args.benchmark == "suite":
+        results = suite_benchmark(args.scales, args.repeat, args.seed)
+        if args.baseline:
+            with open(args.baseline) as file:
+                baseline = json.load(file)
+            results = compare_results(results, baseline["results"] if isinstance(baseline, dict) else baseline)
+    elif args.benchmark == "load":
+        results = load_test(args.url, args.clients, args.requests)
+    elif args.benchmark == "crawl":
+        results = crawl_benchmark(args.snapshot, args.latency, args.error_rate, seed = args.seed)
+
+    print_results(results)
+    if args.json:
+        with open(args.json, "w") as file:
+            json.dump({"benchmark": args.benchmark, "commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                       "results": results}, file, indent = 2)
@@ -0,0 +1,200 @@
+####Full Name: Haoyang Zeng
+####Unique Name: haoyangz
+
+import Final_Project as fp
+import argparse
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+
+def url_path(url):
+    '''Return the path and query of a url, the part a server sees in its request line.
+
+    Parameters
+    ----------
+    url: str
+        The full url.
+
+    Returns
+    -------
+    path: str
+        Everything after the host, starting with a single slash. Repeated
+        leading slashes are collapsed, as the HTTP client sends them that way.
+    '''
+    rest = url.split("://", 1)[-1]
+    return "/" + rest[rest.index("/"):].lstrip("/") if "/" in rest else "/"
+
+
+class MockWiki:
+    '''The recorded pages and images of the wiki, read from a snapshot written by
+    Final_Project.py export or from a folder with one file per page path.
+    Pages are found by path, so the recording can be replayed under any base
+    url. Images are found by file name.
+    Every response can be delayed by latency plus up to jitter seconds, and a
+    fraction error_rate of the requests fails with a 503.
+    '''
+    def __init__(self, snapshot, latency = 0.0, jitter = 0.0, error_rate = 0.0, seed = 0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.stats = {"requests": 0, "pages": 0, "images": 0, "not_modified": 0, "not_found": 0, "errors": 0, "bytes": 0}
+        self.pages = {}
+        self.images = {}
+        if Path(snapshot).is_dir():
+            self.load_folder(Path(snapshot))
+            return
+        connection = sqlite3.connect(snapshot)
+        for url, body, etag, digest in connection.execute("SELECT Url, Body, ETag, Hash FROM Pages"):
+            self.pages[url_path(url)] = (fp.decompress_body(body).encode("utf-8"), etag or (f'"{digest}"' if digest else None))
+        self.images = dict(connection.execute("SELECT Name, Data FROM Images"))
+        connection.close()
+
+    def load_folder(self, folder):
+        '''Load a folder of recorded files. A file is served at its path relative
+        to the folder, or by its name if it is an image.'''
+        for path in sorted(folder.rglob("*")):
+            if not path.is_file():
+                continue
+            data = path.read_bytes()
+            if fp.image_type(data)[1] != ".bin":
+                self.images[path.name] = data
+            else:
+                self.pages["/" + path.relative_to(folder).as_posix()] = (data, f'"{hashlib.sha256(data).hexdigest()}"')
+
+    def draw(self):
+        '''Draw the delay and whether to fail for the next request, and count it.'''
+        with self.lock:
+            self.stats["requests"] += 1
+            delay = self.latency + self.random.uniform(0, self.jitter)
+            failed = self.random.random() < self.error_rate
+            if failed:
+                self.stats["errors"] += 1
+        return delay, failed
+
+    def count(self, key, size = 0):
+        '''Count a response and its bytes.'''
+        with self.lock:
+            self.stats[key] += 1
+            self.stats["bytes"] += size
+
+    def summary(self):
+        '''Return the request counts of the server.'''
+        with self.lock:
+            return dict(self.stats)
+
+
+class MockWikiHandler(BaseHTTPRequestHandler):
+    '''Serve the pages and images of the MockWiki of the server, with ETag revalidation.'''
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        wiki = self.server.wiki
+        delay, failed = wiki.draw()
+        if delay:
+            time.sleep(delay)
+        if failed:
+            self.send_body(503, b"", "text/plain")
+            return
+        path = "/" + self.path.lstrip("/")
+        if path in wiki.pages:
+            body, etag = wiki.pages[path]
+            if etag is not None and self.headers.get("If-None-Match") == etag:
+                wiki.count("not_modified")
+                self.send_response(304)
+                self.send_header("ETag", etag)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+                return
+            wiki.count("pages", len(body))
+            self.send_body(200, body, "text/html; charset=utf-8", etag)
+            return
+        name = path.split("?")[0].rsplit("/", 1)[-1]
+        if name in wiki.images:
+            data = wiki.images[name]
+            wiki.count("images", len(data))
+            self.send_body(200, data, fp.image_type(data)[0])
+            return
+        wiki.count("not_found")
+        self.send_body(404, b"", "text/plain")
+
+    def send_body(self, status, body, content_type, etag = None):
+        '''Send a complete response.'''
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class MockWikiServer(ThreadingHTTPServer):
+    '''A threading HTTP server that replays a MockWiki.'''
+    daemon_threads = True
+    request_queue_size = fp.SERVER_BACKLOG
+
+    def __init__(self, address, wiki):
+        super().__init__(address, MockWikiHandler)
+        self.wiki = wiki
+
+
+def make_mock_server(snapshot, host = "127.0.0.1", port = 0, latency = 0.0, jitter = 0.0, error_rate = 0.0, seed = 0):
+    '''Create a mock wiki server for a snapshot without starting it.
+
+    Parameters
+    ----------
+    snapshot: str
+        The path of a snapshot written by Final_Project.py export, or of a
+        folder of recorded pages and images.
+    host: str
+        The address to listen on.
+    port: int
+        The port to listen on, 0 for any free port.
+    latency: float
+        The delay of every response in seconds.
+    jitter: float
+        The most extra random delay of every response in seconds.
+    error_rate: float
+        The fraction of requests that fail with a 503.
+    seed: int
+        The seed of the delays and errors.
+
+    Returns
+    -------
+    server: MockWikiServer
+        The server, call serve_forever to start it. Its base url is
+        http://host:server.server_address[1]/.
+    '''
+    return MockWikiServer((host, port), MockWiki(snapshot, latency, jitter, error_rate, seed))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description = "Replay recorded wiki pages from a snapshot as a local mock wiki.")
+    parser.add_argument("snapshot", help = "a snapshot written by Final_Project.py export, or a folder of recorded pages")
+    parser.add_argument("--host", default = "127.0.0.1")
+    parser.add_argument("--port", type = int, default = 8765)
+    parser.add_argument("--latency", type = float, default = 0.0, help = "delay of every response in seconds")
+    parser.add_argument("--jitter", type = float, default = 0.0, help = "most extra random delay in seconds")
+    parser.add_argument("--error-rate", type = float, default = 0.0, help = "fraction of requests that fail with a 503")
+    parser.add_argument("--seed", type = int, default = 0)
+    args = parser.parse_args()
+
+    server = make_mock_server(args.snapshot, args.host, args.port, args.latency, args.jitter, args.error_rate, args.seed)
+    print(f"Mock wiki with {len(server.wiki.pages)} pages and {len(server.wiki.images)} images on "
+          f"http://{args.host}:{server.server_address[1]}/")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+        print(server.wiki.summary())
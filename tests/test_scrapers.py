@@ -0,0 +1,229 @@
+####Full Name: Haoyang Zeng
+####Unique Name: haoyangz
+
+import sys
+import shutil
+import sqlite3
+import tempfile
+import threading
+import unittest
+import hashlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import Final_Project as fp
+import mock_wiki
+import requests
+
+FIXTURE = Path(__file__).resolve().parent / "fixtures" / "wiki"
+
+
+def dump(filename):
+    '''Return every scraped row of a database in a stable order, with images as their bytes.'''
+    connection = sqlite3.connect(filename)
+    image = "(SELECT Data FROM Images WHERE Images.Id = ImageId)"
+    tables = [
+        connection.execute(f"SELECT Name, Url, Info, Gender, {image} FROM NPCs ORDER BY Name").fetchall(),
+        connection.execute("SELECT Name, Url, Info, PreviousLocation, NextLocation FROM Locations ORDER BY Name").fetchall(),
+        connection.execute("SELECT Quests.Name, Quests.Url, Giver, Locations.Name, Reward, Category FROM Quests "
+                           "LEFT JOIN Locations ON Locations.Id = Quests.Location ORDER BY Quests.Name").fetchall(),
+        connection.execute(f"SELECT Name, Url, Location, Price, {image} FROM Fishes ORDER BY Name").fetchall(),
+        connection.execute("SELECT Fishes.Name, Locations.Name FROM FishingLocation JOIN Fishes ON Fishes.Id = Fish "
+                           "JOIN Locations ON Locations.Id = FishingLocation.Location ORDER BY 1, 2").fetchall(),
+    ]
+    connection.close()
+    return tables
+
+
+class ScraperTest(unittest.TestCase):
+    '''Build databases from the recorded pages in fixtures/wiki, served by a local mock wiki.'''
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = mock_wiki.make_mock_server(str(FIXTURE))
+        threading.Thread(target = cls.server.serve_forever, daemon = True).start()
+        cls.saved = (fp.base_url, fp.DBNAME, fp.page_cache, fp.image_cache, fp.http_client, fp.PARSE_WORKERS)
+        fp.set_base_url(f"http://127.0.0.1:{cls.server.server_address[1]}/")
+
+    @classmethod
+    def tearDownClass(cls):
+        base_url, DBNAME, fp.page_cache, fp.image_cache, fp.http_client, fp.PARSE_WORKERS = cls.saved
+        fp.set_base_url(base_url)
+        fp.use_database(DBNAME)
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        self.folder = Path(tempfile.mkdtemp())
+        self.addCleanup(shutil.rmtree, self.folder, True)
+        self.use_caches("cache")
+
+    def use_caches(self, name):
+        '''Point the scrapers at an empty page cache, image folder and HTTP client.'''
+        fp.page_cache = fp.PageCache(str(self.folder / f"{name}_pages.sqlite"))
+        self.addCleanup(fp.page_cache.close)
+        fp.image_cache = fp.ImageCache(self.folder / f"{name}_images")
+        fp.http_client = fp.HttpClient(backoff = 0.01)
+        self.addCleanup(fp.http_client.close)
+
+    def build(self, name):
+        '''Build a database from scratch with the streaming loader and return its path.'''
+        fp.use_database(str(self.folder / name))
+        fp.create_tables()
+        fp.insert_data()
+        return self.folder / name
+
+    def requests_made(self):
+        return self.server.wiki.summary()["requests"]
+
+    def start_wiki(self, **options):
+        '''Point the scrapers at a mock wiki of their own for this test, which it may edit.'''
+        server = mock_wiki.make_mock_server(str(FIXTURE), **options)
+        threading.Thread(target = server.serve_forever, daemon = True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.addCleanup(fp.set_base_url, fp.base_url)
+        fp.set_base_url(f"http://127.0.0.1:{server.server_address[1]}/")
+        return server.wiki
+
+    def edit_page(self, wiki, path, old = None, new = None, body = None):
+        '''Replace text in a page of the wiki, or set its body, and give it a new ETag.'''
+        if body is None:
+            body = wiki.pages[path][0].replace(old.encode(), new.encode())
+        wiki.pages[path] = (body, f'"{hashlib.sha256(body).hexdigest()}"')
+
+    def update(self):
+        '''Run update_data as the update command does, in a run that has not fetched anything yet.'''
+        fp.page_cache.fresh.clear()
+        fp.page_cache.changed.clear()
+        return fp.update_data()
+
+    def test_build(self):
+        '''The scrapers build a complete database from a local stand-in of the wiki (user-002).'''
+        NPCs, locations, quests, fishes, fishing = dump(self.build("NieR.sqlite"))
+        self.assertEqual(len(NPCs), 6)
+        self.assertIn("Pascal", [row[0] for row in NPCs])
+        self.assertTrue(all(row[4] is not None for row in NPCs + fishes))
+        self.assertEqual(len(fishes), 4)
+        self.assertTrue(quests and fishing)
+
+    def test_warm_rebuild_makes_no_requests(self):
+        '''A warm rebuild is served from the caches without a single request (user-003).'''
+        cold = dump(self.build("cold.sqlite"))
+        before = self.requests_made()
+        warm = dump(self.build("warm.sqlite"))
+        self.assertEqual(self.requests_made(), before)
+        self.assertEqual(warm, cold)
+
+    def test_streaming_matches_batch_load(self):
+        '''The streaming build gives the same rows as a batch load_data (user-015).'''
+        streamed = dump(self.build("streamed.sqlite"))
+        fp.use_database(str(self.folder / "loaded.sqlite"))
+        fp.create_tables()
+        fp.load_data(fp.get_NPCs(), fp.get_locations(), fp.get_main_quests() + fp.get_side_quests(), fp.get_fishes())
+        self.assertEqual(dump(self.folder / "loaded.sqlite"), streamed)
+
+    def test_parse_workers_match_serial(self):
+        '''Parsing in worker processes gives the same rows as parsing serially (user-016).'''
+        serial = dump(self.build("serial.sqlite"))
+        self.use_caches("parallel")
+        fp.PARSE_WORKERS = 2
+        self.addCleanup(setattr, fp, "PARSE_WORKERS", self.saved[5])
+        self.assertEqual(dump(self.build("parallel.sqlite")), serial)
+
+    def test_stats_tables_follow_changes(self):
+        '''After every insert, update and delete, each stats table equals its aggregate query (user-021).'''
+        connection = sqlite3.connect(self.build("NieR.sqlite"))
+        changes = [
+            "INSERT INTO Quests (Name, Url, Giver, Location, Reward, Category) "
+            "SELECT 'Test Quest', 'test', 'Pascal', Id, NULL, 'side' FROM Locations WHERE Name = 'Desert'",
+            "UPDATE Quests SET Giver = 'Jackass' WHERE Giver = 'Pascal' AND Name != 'Test Quest'",
+            "UPDATE Fishes SET Price = Price * 3 WHERE Name = 'Carp'",
+            "DELETE FROM FishingLocation WHERE Fish = (SELECT Id FROM Fishes WHERE Name = 'Mackerel')",
+            "DELETE FROM Fishes WHERE Name = 'Mackerel'",
+            "DELETE FROM Quests WHERE Id = (SELECT MIN(Id) FROM Quests)",
+        ]
+        for change in changes:
+            connection.execute(change)
+            connection.commit()
+            for option, (description, query, stats_table) in fp.STATS_QUERIES.items():
+                expected = sorted(connection.execute(query).fetchall(), key = repr)
+                stored = sorted(connection.execute(f"SELECT Name, Value FROM {stats_table}").fetchall(), key = repr)
+                self.assertEqual(stored, expected, f"{description} after {change}")
+        connection.close()
+
+    def test_error_responses_are_not_cached(self):
+        '''Retried 503 responses raise and never reach the page cache (user-004).'''
+        self.start_wiki(error_rate = 1.0)
+        with self.assertRaises(requests.HTTPError):
+            fp.get_NPCs()
+        self.assertIsNone(fp.page_cache.get_entry(fp.NPC_url))
+
+    def test_update_unchanged_wiki(self):
+        '''An update of an unchanged wiki reports nothing (user-005).'''
+        self.start_wiki()
+        built = dump(self.build("NieR.sqlite"))
+        self.assertEqual(self.update(), {})
+        self.assertEqual(dump(self.folder / "NieR.sqlite"), built)
+
+    def test_update_changed_page(self):
+        '''An update rewrites only the row of a changed page (user-005).'''
+        wiki = self.start_wiki()
+        self.build("NieR.sqlite")
+        self.edit_page(wiki, "/Pascal", "Pascal is an NPC.", "Pascal runs the village.")
+        report = self.update()
+        self.assertEqual(list(report), ["NPCs"])
+        self.assertEqual(report["NPCs"], {"inserted": 0, "updated": 1, "deleted": 0})
+        NPCs = dump(self.folder / "NieR.sqlite")[0]
+        self.assertIn("Pascal runs the village. Yes.", [row[2] for row in NPCs])
+
+    def test_update_removed_entity(self):
+        '''An update deletes an entity that left the index without requesting its gone page (user-005).'''
+        wiki = self.start_wiki()
+        self.build("NieR.sqlite")
+        self.edit_page(wiki, "/NPCs", "<div class='col-sm-4'><img src='/file/Sartre.jpg'><h3 style='text-align: center;'>"
+                       "<a href='/Sartre'>Sartre</a></h3></div>", "")
+        del wiki.pages["/Sartre"]
+        report = self.update()
+        self.assertEqual(report["NPCs"], {"inserted": 0, "updated": 0, "deleted": 1})
+        NPCs = dump(self.folder / "NieR.sqlite")[0]
+        self.assertEqual(len(NPCs), 5)
+        self.assertNotIn("Sartre", [row[0] for row in NPCs])
+
+    def test_update_moved_url(self):
+        '''An update keeps a row whose page moved to a new url under the same name (user-005).'''
+        wiki = self.start_wiki()
+        connection = sqlite3.connect(self.build("NieR.sqlite"))
+        before = connection.execute("SELECT Id, Name, Info FROM NPCs ORDER BY Id").fetchall()
+        self.edit_page(wiki, "/NPCs", "href='/Pascal'", "href='/Pascal+(NPC)'")
+        self.edit_page(wiki, "/Pascal+(NPC)", body = wiki.pages.pop("/Pascal")[0])
+        report = self.update()
+        self.assertEqual(report["NPCs"], {"inserted": 0, "updated": 1, "deleted": 0})
+        self.assertEqual(connection.execute("SELECT Id, Name, Info FROM NPCs ORDER BY Id").fetchall(), before)
+        self.assertTrue(connection.execute("SELECT Url FROM NPCs WHERE Name = 'Pascal'").fetchone()[0].endswith("/Pascal+(NPC)"))
+        connection.close()
+
+    def test_update_migrates_image_blobs(self):
+        '''An update moves the Image blobs of an old database into Images (user-005, user-010).'''
+        self.start_wiki()
+        built = dump(self.build("new.sqlite"))
+        old = sqlite3.connect(self.folder / "NieR.sqlite")
+        old.execute("ATTACH ? AS new", (str(self.folder / "new.sqlite"), ))
+        old.execute("CREATE TABLE NPCs (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, "
+                    "Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Info TEXT, Gender TEXT, Image BLOB)")
+        old.execute("CREATE TABLE Fishes (Id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE, "
+                    "Name TEXT NOT NULL UNIQUE COLLATE NOCASE, Url TEXT UNIQUE, Location TEXT COLLATE NOCASE, Price INTEGER, Image BLOB)")
+        old.execute("INSERT INTO NPCs SELECT n.Id, n.Name, n.Url, n.Info, n.Gender, i.Data FROM new.NPCs n JOIN new.Images i ON i.Id = n.ImageId")
+        old.execute("INSERT INTO Fishes SELECT f.Id, f.Name, f.Url, f.Location, f.Price, i.Data FROM new.Fishes f JOIN new.Images i ON i.Id = f.ImageId")
+        for table in ["Locations", "Quests", "FishingLocation"]:
+            old.execute(f"CREATE TABLE {table} AS SELECT * FROM new.{table}")
+        old.commit()
+        old.close()
+        fp.use_database(str(self.folder / "NieR.sqlite"))
+        self.assertEqual(self.update(), {})
+        self.assertEqual(dump(self.folder / "NieR.sqlite"), built)
+
+
+if __name__ == "__main__":
+    unittest.main()